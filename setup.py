@@ -9,6 +9,7 @@ requires = [
     'numpy',
     'scipy',
     'spacepy',
+    'h5py',
     'matplotlib',
     'pytz',
     'cdaweb@git+https://github.com/jhaiduce/cdaweb',
@@ -2,62 +2,276 @@ from datetime import datetime, timedelta
 import numpy as np
 from pytz import UTC
 from scipy.special import erf
+from substorm_utils.timeseries import to_seconds, timedelta_seconds, tnums_to_times
 
-def filter_onsets(substorms,onset_list,tstart=datetime(2005,1,1,tzinfo=UTC),tstep=timedelta(0,1800)):
-    onset_bins=[int((onset-tstart).total_seconds()/tstep.total_seconds()) for onset in onset_list]
+def _tnum_range(tmin,tmax,step,epoch):
+    """
+    Evenly spaced times from tmin up to (not including) tmax, in seconds since epoch.
 
-    onset_list_filtered=np.array(onset_list)[substorms[onset_bins]]
-                
-    return onset_list_filtered
+    tmin,tmax,epoch: datetime or datetime64
+    step: timedelta, timedelta64, or seconds
+    """
+
+    return np.arange(to_seconds(tmin,epoch),to_seconds(tmax,epoch),timedelta_seconds(step))
+
+class TimeBins(object):
+    """
+    Evenly spaced time bins from start up to stop, which can be shared by
+    the functions in this module that bin onsets, so that the bins are
+    computed once rather than on every call.
+
+    start,stop: Start of the first bin and end of the last (datetime or
+        datetime64). The last bin is shorter than step if stop-start is
+        not a multiple of step.
+    step: Bin width (timedelta, timedelta64, or seconds)
+    epoch: Times given as numbers are in seconds since epoch (default start)
+    """
+
+    def __init__(self,start,stop,step,epoch=None):
+        if epoch is None:
+            epoch=start
+
+        self.epoch=epoch
+        self.step=timedelta_seconds(step)
+        self.start_tnum=to_seconds(start,epoch)
+        self.stop_tnum=to_seconds(stop,epoch)
+
+        # Bin start times in seconds since epoch
+        self.edges=_tnum_range(start,stop,step,epoch)
+
+    @property
+    def nbins(self):
+        return len(self.edges)
+
+    def index(self,times):
+        """
+        Bin index of each of times, or -1 for times outside [start,stop).
+        """
+
+        tnums=to_seconds(times,self.epoch)
+        inds=np.asarray(np.floor((tnums-self.start_tnum)/self.step)).astype(int)
+        inds[(inds<0) | (inds>=self.nbins) | (tnums>=self.stop_tnum)]=-1
+
+        return inds
+
+    def counts(self,times):
+        """
+        Number of times in each bin.
+        """
+
+        inds=self.index(times)
+
+        return np.bincount(inds[inds>=0],minlength=self.nbins)
+
+    def bin_times(self,inds):
+        """
+        Start times of bins (of the same kind as epoch).
+        """
+
+        return tnums_to_times(self.edges[inds],self.epoch)
+
+def filter_onsets(substorms,onset_list,tstart=datetime(2005,1,1,tzinfo=UTC),tstep=timedelta(0,1800),bins=None):
+    """
+    Selects the onsets that fall in substorm bins.
 
-def make_grid(signatures,tstart=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),tstep=timedelta(0,1800),signature_filters=None,return_times=False,epoch=datetime(2005,1,1,tzinfo=UTC)):
+    substorms: Boolean array with one element per bin, or a sorted array of
+        substorm bin indices (as returned by substorm_occurrences for a
+        SparseGrid)
+    bins: TimeBins to use in place of tstart and tstep. Onsets outside the
+        bins are dropped.
+    """
 
-    tmax_tnum=(tmax-epoch).total_seconds()
+    if bins is None:
+        onset_bins=(to_seconds(onset_list,tstart)/timedelta_seconds(tstep)).astype(int)
+        in_range=np.ones(len(onset_bins),dtype=bool)
+    else:
+        onset_bins=bins.index(onset_list)
+        in_range=onset_bins>=0
 
-    tstep=tstep.total_seconds()
+    substorms=np.asarray(substorms)
+    if substorms.dtype==bool:
+        in_substorm=in_range
+        in_substorm[in_range]=substorms[onset_bins[in_range]]
+    else:
+        in_substorm=np.isin(onset_bins,substorms) & in_range
 
-    nsteps=int(tmax_tnum/tstep)
+    onset_list_filtered=np.array(onset_list)[in_substorm]
+                
+    return onset_list_filtered
+
+class SparseGrid(object):
+    """
+    Sparse equivalent of the grid returned by make_grid: for each signature,
+    the sorted indices of the bins containing at least one onset.
+
+    inds: List of sorted, unique bin index arrays, one per signature
+    nsteps: Number of bins
+    time_inds,time_tnums: Lists holding, for each signature, the indices and
+        values of the non-masked elements of the times array make_grid
+        returns with return_times=True (or None)
+    """
+
+    def __init__(self,inds,nsteps,time_inds=None,time_tnums=None):
+        self.inds=inds
+        self.nsteps=nsteps
+        self.time_inds=time_inds
+        self.time_tnums=time_tnums
+
+    @property
+    def shape(self):
+        return (len(self.inds),self.nsteps)
+
+    def toarray(self):
+        """
+        Returns the dense grid.
+        """
+
+        grid=np.zeros(self.shape)
+        for i,inds in enumerate(self.inds):
+            grid[i,inds]=1
+
+        return grid
+
+    def counts(self,rows=None):
+        """
+        Number of signatures in each bin containing any, as arrays of bin
+        indices and counts. Equivalent to the non-zero elements of
+        grid[rows].sum(axis=0) for the dense grid.
+        """
+
+        if rows is None:
+            rows=range(len(self.inds))
+
+        all_inds=np.concatenate([np.zeros(0,dtype=int)]+[self.inds[i] for i in rows])
+
+        return np.unique(all_inds,return_counts=True)
+
+    def min_times(self,bins,rows=None):
+        """
+        Equivalent to np.ma.min(times[rows][:,bins],axis=0) for the times
+        array of the dense grid.
+        """
+
+        if self.time_inds is None:
+            raise ValueError('SparseGrid has no times; pass return_times=True to make_grid')
+
+        if rows is None:
+            rows=range(len(self.inds))
+
+        bins=np.asarray(bins,dtype=int)
+        inds=np.concatenate([np.zeros(0,dtype=int)]+[self.time_inds[i] for i in rows])
+        tnums=np.concatenate([np.zeros(0)]+[self.time_tnums[i] for i in rows])
+
+        # Earliest time in each bin
+        order=np.lexsort((tnums,inds))
+        inds,first=np.unique(inds[order],return_index=True)
+        tnums=tnums[order][first]
+
+        result=np.ma.array(np.zeros(len(bins)),mask=True)
+        if len(inds)>0:
+            pos=np.minimum(np.searchsorted(inds,bins),len(inds)-1)
+            found=inds[pos]==bins
+            result[found]=tnums[pos[found]]
+
+        return result
+
+def make_grid(signatures,tstart=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),tstep=timedelta(0,1800),signature_filters=None,return_times=False,epoch=datetime(2005,1,1,tzinfo=UTC),sparse=False,bins=None):
+    """
+    Bins onsets into a grid with one row per signature and one column per
+    time step, set to 1 where the signature has an onset.
+
+    signatures: Dictionary of onset times (datetime, datetime64, or seconds
+        since epoch) keyed by signature type. Times returned with
+        return_times are in seconds since epoch.
+    sparse: If True, return a SparseGrid instead of a dense array. Its
+        times (if return_times is True) are stored in the SparseGrid, which
+        is returned in place of the times array.
+    bins: TimeBins to use in place of tstart, tmax, tstep and epoch. The
+        grid then has bins.nbins columns.
+    """
+
+    if bins is None:
+        bins=TimeBins(tstart,tmax,tstep,epoch)
+        nsteps=int(to_seconds(tmax,epoch)/bins.step)
+    else:
+        nsteps=bins.nbins
 
     if signature_filters is not None:
         nsigs=len(signature_filters)
     else:
         nsigs=len(signatures)
 
-    grid=np.zeros((nsigs,nsteps))
+    grid_tnums=bins.edges
 
-    grid_tnums=np.arange((tstart-epoch).total_seconds(),(tmax-epoch).total_seconds(),tstep)
+    if sparse:
+        grid=SparseGrid([],nsteps)
+        if return_times:
+            grid.time_inds=[]
+            grid.time_tnums=[]
+    else:
+        grid=np.zeros((nsigs,nsteps))
 
-    if return_times:
+    if return_times and not sparse:
         times=np.ma.array(np.zeros((nsigs,nsteps)),mask=1)
 
     names=[]
 
     i=0
 
-    for name,signature_tnums in signatures.iteritems():
+    for name,signature_tnums in signatures.items():
 
         if signature_filters and name not in signature_filters:
             continue
 
+        signature_tnums=to_seconds(signature_tnums,bins.epoch)
+
         grid_inds,unique_idx=np.unique(np.searchsorted(grid_tnums,signature_tnums,side='right'),return_index=True)
-        mask=(grid_inds>0) & (grid_inds<grid.shape[1])
+        mask=(grid_inds>0) & (grid_inds<nsteps)
         grid_inds=grid_inds[mask]
         unique_idx=unique_idx[mask]
 
-        grid[i,grid_inds-1]=1
+        if sparse:
+            grid.inds.append(grid_inds-1)
+            if return_times:
+                grid.time_inds.append(grid_inds)
+                grid.time_tnums.append(np.asarray(signature_tnums,dtype=float)[unique_idx])
+        else:
+            grid[i,grid_inds-1]=1
 
-        if return_times:
-            times[i,grid_inds]=signature_tnums[unique_idx]
+            if return_times:
+                times[i,grid_inds]=signature_tnums[unique_idx]
         
         names.append(name)
         i+=1
 
-    if return_times:
+    if sparse and return_times:
+        return grid,grid,names
+    elif return_times:
         return grid,times,names
     else:
         return grid,names
 
 def substorm_occurrences(grid,threshold,mandatory_signature_inds=()):
+    """
+    Finds the bins in which at least threshold signatures have onsets.
+
+    grid: Grid returned by make_grid
+    mandatory_signature_inds: Rows of grid that must have an onset in a
+        bin for it to count as a substorm
+
+    Returns a boolean array with one element per bin, or, if grid is a
+    SparseGrid, a sorted array of substorm bin indices.
+    """
+
+    if isinstance(grid,SparseGrid):
+        if threshold<=0:
+            substorms=np.arange(grid.nsteps)
+        else:
+            inds,counts=grid.counts()
+            substorms=inds[counts>=threshold]
+        for ind in mandatory_signature_inds:
+            substorms=np.intersect1d(substorms,grid.inds[ind],assume_unique=True)
+        return substorms
 
     substorms=((grid).sum(axis=0)>=threshold)
 
@@ -66,55 +280,337 @@ def substorm_occurrences(grid,threshold,mandatory_signature_inds=()):
 
     return substorms
 
-def interval_counts(times,tmin=datetime(2005,1,1),tmax=datetime(2005,2,1),tstep=timedelta(0,1800)):
+def interval_counts(times,tmin=datetime(2005,1,1),tmax=datetime(2005,2,1),tstep=timedelta(0,1800),bins=None):
+    """
+    Number of times in each complete tstep-long interval from tmin to tmax.
 
-    nsteps=(tmax-tmin).total_seconds()/tstep.total_seconds()
+    bins: TimeBins to use in place of tmin, tmax and tstep (all of its
+        bins are counted)
 
-    grid=np.zeros((1,nsteps))
+    Returns a 1 by number of intervals array.
+    """
 
-    for time in times:
-        if time<tmin or time>tmax: continue
-        ti=int((time-tmin).total_seconds()/tstep.total_seconds())
-        grid[0,ti]+=1
+    if bins is None:
+        bins=TimeBins(tmin,tmax,tstep)
+        nsteps=int(bins.stop_tnum/bins.step)
+    else:
+        nsteps=bins.nbins
+
+    grid=bins.counts(times)[:nsteps].astype(float).reshape(1,nsteps)
 
     return grid
 
 from cache_decorator import cache_result
 
-def convolve_onsets(onset_tnums,tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),resolution=timedelta(seconds=60),bandwidth=timedelta(seconds=60*15),epoch=datetime(2005,1,1,tzinfo=UTC)):
-
-    out_tnums=np.arange((tmin-epoch).total_seconds(),(tmax-epoch).total_seconds(),resolution.total_seconds())
+def _convolve_direct(pulses,kernel):
+    return np.convolve(pulses,kernel,mode='same')
 
-    bw_sec=bandwidth.total_seconds()
+def _convolve_fft(pulses,kernel):
+    try:
+        from scipy.signal import oaconvolve as fftconvolve
+    except ImportError:
+        from scipy.signal import fftconvolve
+
+    return fftconvolve(pulses,kernel,mode='same')
+
+def _convolve_sparse(pulses,kernel,max_elements=10000000):
+    n=len(pulses)
+    m=len(kernel)
+    shift=(m-1)//2
+
+    pulse_inds=np.nonzero(pulses)[0]
+    out=np.zeros(n)
+
+    # Add the kernel around each pulse, a limited number of pulses at a time
+    chunksize=max(max_elements//m,1)
+    for start in range(0,len(pulse_inds),chunksize):
+        chunk_inds=pulse_inds[start:start+chunksize]
+        out_inds=chunk_inds[:,np.newaxis]-shift+np.arange(m)
+        weights=pulses[chunk_inds][:,np.newaxis]*kernel
+        in_range=(out_inds>=0) & (out_inds<n)
+        out+=np.bincount(out_inds[in_range],weights[in_range],minlength=n)
+
+    return out
+
+def _choose_convolution_method(pulses,kernel):
+    n=len(pulses)
+    m=len(kernel)
+
+    if m>n:
+        # Only direct convolution reproduces np.convolve's output length in this case
+        return 'direct'
+
+    costs={
+        'direct':float(n)*m,
+        'fft':10.*(n+m)*np.log2(n+m),
+        'sparse':3.*np.count_nonzero(pulses)*m,
+    }
+
+    return min(costs,key=costs.get)
+
+_convolution_methods={
+    'direct':_convolve_direct,
+    'fft':_convolve_fft,
+    'sparse':_convolve_sparse,
+}
+
+_eps=np.finfo(float).eps
+
+def _sum_error(counts):
+    """
+    Bound on the difference between two sums of the kernel around counts
+    onsets, added in different orders (as by the direct and sparse
+    methods). Each term is at most the kernel peak of 1.
+    """
+
+    return 2*np.asarray(counts,dtype=float)**2*_eps
+
+def _convolution_error(pulses,kernel):
+    """
+    Bound on the difference at each step between the convolutions computed
+    by any two of the methods.
+    """
+
+    n=len(pulses)
+    m=len(kernel)
+
+    # Onsets within reach of each step
+    shift=(m-1)//2
+    total=np.concatenate([[0],np.cumsum(pulses)])
+    steps=np.arange(n)
+    error=_sum_error(total[np.clip(steps+shift+1,0,n)]-total[np.clip(steps+shift-m+1,0,n)])
+
+    # A few times the largest round-off seen from scipy's FFT convolution
+    return error+4*_eps*np.log2(n+m)*np.sqrt(np.sum(pulses**2)*np.sum(kernel**2))
+
+def _score_error(convolution_error):
+    """
+    Bound on the difference between erf of two convolutions that differ by
+    at most convolution_error, including the round-off of erf itself.
+    """
+
+    return np.where(convolution_error>0,2/np.sqrt(np.pi)*convolution_error+2*_eps,0)
+
+def convolve_onsets(onset_tnums,tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),resolution=timedelta(seconds=60),bandwidth=timedelta(seconds=60*15),epoch=datetime(2005,1,1,tzinfo=UTC),method='auto',bins=None,return_error=False):
+    """
+    Convolves a list of onset times (datetime, datetime64, or seconds since
+    epoch) with a Gaussian kernel.
+
+    method: 'direct' (np.convolve), 'fft' (overlap-add/FFT convolution),
+        'sparse' (adds the kernel around each onset), or 'auto' to choose
+        among them based on the number of onsets and the kernel length. All
+        give the same scores to within floating point round-off. The fft
+        and sparse methods require the kernel (12 bandwidths) to be no
+        longer than tmax-tmin.
+    bins: TimeBins to use in place of tmin, tmax, resolution and epoch
+    return_error: If True, also return a bound on the difference at each
+        step between the scores of any two methods. The bound is the same
+        for all methods; passed as the tolerance of search_convolution_scores,
+        it makes them find the same onsets.
+    """
+
+    if bins is None:
+        bins=TimeBins(tmin,tmax,resolution,epoch)
+
+    out_tnums=bins.edges
+
+    bw_sec=timedelta_seconds(bandwidth)
+    resolution=bins.step
 
     pulses=np.zeros(out_tnums.shape)
-    pulses[:-1]=np.histogram(onset_tnums,out_tnums)[0]
+    pulses[:-1]=np.histogram(to_seconds(onset_tnums,bins.epoch),out_tnums)[0]
 
-    m=int(bw_sec*6/resolution.total_seconds())
-    x=np.arange(-m,m)*resolution.total_seconds()
+    m=int(bw_sec*6/resolution)
+    x=np.arange(-m,m)*resolution
     g=np.exp(-x**2/2/bw_sec**2)
 
-    out=np.convolve(pulses,g,mode='same')
+    if method=='auto':
+        method=_choose_convolution_method(pulses,g)
+
+    try:
+        convolve=_convolution_methods[method]
+    except KeyError:
+        raise ValueError('Invalid method passed {} to convolve_onsets'.format(method))
+
+    if method!='direct' and len(g)>len(pulses):
+        raise ValueError('The {} method of convolve_onsets requires the kernel to be no longer than the time range'.format(method))
+
+    out=erf(convolve(pulses,g))
+
+    if return_error:
+        return out,out_tnums,_score_error(_convolution_error(pulses,g))
+    else:
+        return out,out_tnums
+
+def sum_signature_scores(signature_scores,keys,signature_weights={},signature_errors=None):
+    """
+    Weighted sum of convolved signature scores, as computed by
+    convolved_substorm_scores.
+
+    signature_scores: Dictionary of scores keyed by signature type
+    keys: Signature types to sum, in order. Types with weights of zero or
+        less are left out.
+    signature_weights: Weights keyed by signature type (default 1)
+    signature_errors: Dictionary of the errors returned by convolve_onsets,
+        keyed by signature type. If given, a bound on the difference between
+        the sums computed from the scores of any two methods is also
+        returned.
+    """
+
+    weights=[signature_weights.get(key,1) for key in keys]
+    keys=[key for key,weight in zip(keys,weights) if weight>0]
+    weights=[weight for weight in weights if weight>0]
+
+    scores=np.sum([signature_scores[key]*weight for key,weight in zip(keys,weights)],axis=0)
+
+    if signature_errors is None:
+        return scores
+
+    error=np.sum([signature_errors[key]*weight for key,weight in zip(keys,weights)],axis=0)
+
+    # Round-off of the weighting and the sum, wherever the terms can differ
+    error=np.where(error>0,error+2*len(weights)*_eps*np.sum(weights),0)
+
+    return scores,error
 
-    out=erf(out)
+def convolved_substorm_scores(signatures,signature_weights={},bandwidth=timedelta(0,60*15),resolution=timedelta(0,60),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),epoch=datetime(2005,1,1,tzinfo=UTC),convolution_method='auto',return_error=False):
+    """
+    Weighted sum of the convolved onsets of each signature type.
 
-    return out,out_tnums
+    return_error: If True, also return a bound on the difference at each
+        step between the scores of any two convolution methods (see
+        convolve_onsets)
+    """
 
-def convolved_substorm_scores(signatures,signature_weights={},bandwidth=timedelta(0,60*15),resolution=timedelta(0,60),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),epoch=datetime(2005,1,1,tzinfo=UTC)):
-    signature_scores=[]
+    signature_scores={}
+    signature_errors={}
     tnums=None
     for key in signatures.keys():
         weight=signature_weights.get(key,1)
         if weight>0:
-            scores,tnums=convolve_onsets(tuple(signatures[key]),resolution=resolution,
-                                         bandwidth=bandwidth,tmin=tmin,tmax=tmax,
-                                         epoch=epoch)
-            signature_scores.append(scores*weight)
-    return np.sum(signature_scores,axis=0),tnums
+            signature_scores[key],tnums,signature_errors[key]=convolve_onsets(
+                tuple(signatures[key]),resolution=resolution,bandwidth=bandwidth,
+                tmin=tmin,tmax=tmax,epoch=epoch,method=convolution_method,return_error=True)
 
-def search_convolution_scores(scores,threshold,require_continuous=True):
-    from scipy.signal import find_peaks
-    local_max_inds,peakprops=find_peaks(scores)
+    scores,error=sum_signature_scores(signature_scores,list(signatures.keys()),signature_weights,signature_errors)
+
+    if return_error:
+        return scores,tnums,error
+    else:
+        return scores,tnums
+
+def _convolution_peaks(scores,tolerance=0):
+    """
+    Indices of local maxima in scores, offset by one sample as in search_convolution_scores.
+
+    Neighbouring scores that differ by no more than the sum of their
+    tolerances are treated as equal. With zero tolerance, the peaks are
+    those found by scipy.signal.find_peaks: the middle of each run of equal
+    scores that is higher than the scores on either side of it.
+    """
+
+    scores=np.asarray(scores)
+    tolerance=np.broadcast_to(tolerance,scores.shape)
+
+    diffs=np.diff(scores)
+    steps=np.nonzero(np.abs(diffs)>tolerance[:-1]+tolerance[1:])[0]
+    rising=diffs[steps]>0
+
+    # A rise followed by a fall, with only equal scores in between
+    peak=rising[:-1] & ~rising[1:]
+    local_max_inds=(steps[:-1][peak]+1+steps[1:][peak])//2
+
+    return local_max_inds+1
+
+def _select_peaks(peak_inds,peak_scores,above_threshold,continuous,require_continuous=True,peak_tolerance=0):
+    """
+    Selects onsets from a list of peaks.
+
+    peak_inds,peak_scores: Indices and scores of the peaks
+    above_threshold: Boolean array, True for peaks whose score exceeds the threshold
+    continuous: Boolean array of length len(peak_inds)-1, True where scores
+        stay above threshold from each peak up to the next one
+    require_continuous: If True, only the highest (first, in case of ties)
+        above-threshold peak in each continuous above-threshold period is
+        kept
+    peak_tolerance: Tolerance of each peak score. Peaks are tied if their
+        scores are equal to within their tolerances.
+
+    Returns the indices of the selected peaks.
+    """
+
+    if not require_continuous or not np.any(above_threshold):
+        return peak_inds[above_threshold]
+
+    # Label continuous above-threshold periods
+    period=np.concatenate([[0],np.cumsum(~continuous)])
+    period=period[above_threshold]
+    inds=peak_inds[above_threshold]
+    scores=peak_scores[above_threshold]
+    tolerance=np.broadcast_to(peak_tolerance,peak_scores.shape)[above_threshold]
+
+    # Highest lower bound on the score in each period
+    new_period=np.concatenate([[True],period[1:]!=period[:-1]])
+    period=np.cumsum(new_period)-1
+    highest=np.maximum.reduceat(scores-tolerance,np.nonzero(new_period)[0])
+
+    # First peak in each period that can be as high as that
+    candidates=np.nonzero(scores+tolerance>=highest[period])[0]
+    first_in_period=np.concatenate([[True],period[candidates][1:]!=period[candidates][:-1]])
+
+    return inds[candidates[first_in_period]]
+
+def sweep_convolution_scores(scores,thresholds,require_continuous=True,tolerance=0):
+    """
+    Equivalent to calling search_convolution_scores once for each of a
+    sequence of scalar thresholds.
+
+    The peaks of scores, their heights, and the minimum score between each
+    pair of consecutive peaks are computed once; each threshold is then
+    evaluated on this table of peaks alone.
+
+    Returns a list containing an array of onset indices for each threshold.
+    """
+
+    scores=np.asarray(scores)
+    tolerance=np.broadcast_to(tolerance,scores.shape)
+    peak_inds=_convolution_peaks(scores,tolerance)
+    peak_scores=scores[peak_inds]
+    peak_tolerance=tolerance[peak_inds]
+
+    # Lowest score from each peak up to the next one
+    if len(peak_inds)>1:
+        gap_mins=np.minimum.reduceat(scores-tolerance,peak_inds)[:-1]
+    else:
+        gap_mins=np.zeros(0)
+
+    return [
+        _select_peaks(peak_inds,peak_scores,peak_scores-peak_tolerance>threshold,gap_mins>threshold,
+                      require_continuous,peak_tolerance)
+        for threshold in thresholds
+    ]
+
+def search_convolution_scores(scores,threshold,require_continuous=True,tolerance=0):
+    """
+    Finds onsets at peaks of a convolved substorm score.
+
+    scores: Sequence of scores
+    threshold: Scalar threshold, or sequence of thresholds of the same length as scores
+    require_continuous: If True, keep only the highest peak (the first, if
+        several are equally high) in each continuous period of
+        above-threshold scores
+    tolerance: Bound on the error of each score (scalar, or sequence of the
+        same length as scores), such as the error returned by
+        convolve_onsets. Scores that are equal to within their tolerances
+        are treated as equal, and a score must exceed threshold by more
+        than its tolerance.
+
+    Returns a list of onset indices. Continuous periods are labeled from the
+    above-threshold mask for all peaks at once, rather than by comparing each
+    peak with the previous onset.
+    """
+
+    scores=np.asarray(scores)
 
     try:
         len(threshold)
@@ -123,77 +619,448 @@ def search_convolution_scores(scores,threshold,require_continuous=True):
     else:
         if len(threshold)!=len(scores):
             raise ValueError('threshold and scores must have same length')
+        threshold=np.asarray(threshold)
 
-    local_max_inds+=1
+    try:
+        tolerance=np.broadcast_to(tolerance,scores.shape)
+    except ValueError:
+        raise ValueError('tolerance and scores must have same length')
 
-    event_inds=[]
+    local_max_inds=_convolution_peaks(scores,tolerance)
 
-    for i,local_max_ind in enumerate(local_max_inds):
-        
-        try:
-            above_threshold=(scores[local_max_ind]>threshold[local_max_ind])
-            threshold_is_scalar=False
-        except (TypeError,IndexError):
-            above_threshold=(scores[local_max_ind]>threshold)
-            threshold_is_scalar=True
-            
-        if above_threshold:
-
-            # Get threshold for this segment (scalar or sequence)
-            if threshold_is_scalar:
-                segment_threshold=threshold
-            else:
-                if len(event_inds)>0:
-                    segment_threshold=threshold[event_inds[-1]:local_max_ind]
-                
-            if require_continuous==True \
-               and len(event_inds)>0 \
-               and np.all(scores[event_inds[-1]:local_max_ind]>segment_threshold):
-                
-                # This max and the previous one are part of a continuous period of above-threshold scores
-                
-                if scores[local_max_ind]>scores[event_inds[-1]]:
+    above_threshold=scores-tolerance>threshold
+
+    # Scores stay above threshold between consecutive peaks if no sample in between is at or below it
+    below_count=np.concatenate([[0],np.cumsum(~above_threshold)])
+    continuous=below_count[local_max_inds[1:]]==below_count[local_max_inds[:-1]]
 
-                    # This max is higher than the last one so we keep it and discard the last one.
-                    event_inds[-1]=local_max_ind
+    event_inds=_select_peaks(local_max_inds,scores[local_max_inds],
+                             above_threshold[local_max_inds],continuous,
+                             require_continuous,tolerance[local_max_inds])
 
-            else:
-                event_inds.append(local_max_ind)
-    return event_inds
+    return list(event_inds)
 
 def find_convolution_onsets(signatures,threshold,signature_weights={},bandwidth=timedelta(0,60*10),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),convolution_resolution=timedelta(0,60),require_continuous=True,epoch=datetime(2005,1,1,tzinfo=UTC)):
-    scores,score_tnums=convolved_substorm_scores(signatures,signature_weights,bandwidth,convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch)
+    scores,score_tnums,error=convolved_substorm_scores(signatures,signature_weights,bandwidth,convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch,return_error=True)
 
-    onset_inds=search_convolution_scores(scores,threshold,require_continuous)
+    onset_inds=search_convolution_scores(scores,threshold,require_continuous,error)
 
     return score_tnums[onset_inds]
 
+class StreamingConvolutionScorer(object):
+    """
+    Incremental version of find_convolution_onsets, for signatures that
+    arrive over time.
+
+    Onsets are passed to update as they arrive, along with the time up to
+    which all onsets have been delivered. The score at a given time is final
+    once that time is more than 6 bandwidths in the past, and an onset is
+    returned once the above-threshold period containing it has ended. Only
+    the scores that are not yet final are kept, so memory use does not grow
+    with the length of the stream, and each onset costs one addition of the
+    kernel.
+
+    threshold: Scalar threshold
+    tmin: Start of the stream
+    signature_weights,bandwidth,convolution_resolution,require_continuous,epoch:
+        As for find_convolution_onsets
+
+    The onsets returned by update and by flush(tmax) are those
+    find_convolution_onsets finds for [tmin,tmax), except that
+    find_convolution_onsets ignores onsets in the last
+    convolution_resolution before tmax. Scores agree to within round-off,
+    and as in find_convolution_onsets, scores that are equal to within
+    their error bounds are treated as equal when finding peaks.
+    """
+
+    def __init__(self,threshold,tmin=datetime(2005,1,1,tzinfo=UTC),signature_weights={},bandwidth=timedelta(0,60*10),convolution_resolution=timedelta(0,60),require_continuous=True,epoch=datetime(2005,1,1,tzinfo=UTC)):
+        self.threshold=threshold
+        self.signature_weights=signature_weights
+        self.require_continuous=require_continuous
+        self.epoch=epoch
+
+        self.resolution=timedelta_seconds(convolution_resolution)
+        self.start_tnum=to_seconds(tmin,epoch)
+
+        # Same kernel as convolve_onsets
+        bw_sec=timedelta_seconds(bandwidth)
+        self.half_width=int(bw_sec*6/self.resolution)
+        if self.half_width<1:
+            raise ValueError('bandwidth must be at least convolution_resolution/6')
+        x=np.arange(-self.half_width,self.half_width)*self.resolution
+        self.kernel=np.exp(-x**2/2/bw_sec**2)
+
+        # Convolution of each signature for the steps whose scores are not
+        # yet final, and the number of onsets added to each, stored in ring
+        # buffers indexed by step modulo their length
+        self._convolutions={}
+        self._counts={}
+        self._next_step=0
+        self._watermark=self.start_tnum
+
+        # Peak search state: the previous score and its error bound, the
+        # rising plateau being followed (first step, number of steps at or
+        # below threshold before it, and the score, error bound, and
+        # above-threshold flag of each step since), and the number of steps
+        # at or below threshold
+        self._prev_score=None
+        self._plateau=None
+        self._below_count=0
+
+        # Current above-threshold period (number of steps at or below
+        # threshold before it, highest lower bound on its peak scores so
+        # far, and the (time,upper bound) of each peak that may be the first
+        # highest one)
+        self._period=None
+
+    def _add_onset(self,name,step):
+        ring=self._convolutions.get(name)
+        if ring is None:
+            ring=np.zeros(len(self.kernel))
+            self._convolutions[name]=ring
+            self._counts[name]=np.zeros(len(self.kernel),dtype=int)
+
+        # As in np.convolve(...,mode='same'), an onset in step j contributes
+        # kernel[l] to step j-half_width+1+l. Steps before the start of the
+        # stream are dropped.
+        steps=step-self.half_width+1+np.arange(len(ring))
+        in_range=steps>=0
+        ring[steps[in_range]%len(ring)]+=self.kernel[in_range]
+        self._counts[name][steps[in_range]%len(ring)]+=1
+
+    def _finalize(self,stop):
+        """
+        Computes the scores of the steps up to stop, and returns the onsets they complete.
+        """
+
+        onsets=[]
+        nring=len(self.kernel)
+
+        for start in range(self._next_step,stop,nring):
+            steps=np.arange(start,min(start+nring,stop))
+            slots=steps%nring
+
+            signature_scores={}
+            signature_errors={}
+            for name,ring in self._convolutions.items():
+                counts=self._counts[name]
+                signature_scores[name]=erf(ring[slots])
+                signature_errors[name]=_score_error(_sum_error(counts[slots]))
+                ring[slots]=0
+                counts[slots]=0
+
+            scores,errors=sum_signature_scores(signature_scores,list(signature_scores.keys()),
+                                               self.signature_weights,signature_errors)
+            scores=scores+np.zeros(len(steps))
+            errors=errors+np.zeros(len(steps))
+
+            for step,score,error in zip(steps,scores,errors):
+                onsets.extend(self._push_score(step,score,error))
+
+        self._next_step=max(self._next_step,stop)
+
+        return onsets
+
+    def _push_score(self,step,score,error):
+        """
+        Advances the peak search (as in _convolution_peaks and
+        search_convolution_scores) by one score.
+        """
+
+        onsets=[]
+        above=score-error>self.threshold
+
+        if self._prev_score is not None:
+            prev_score,prev_error=self._prev_score
+            if abs(score-prev_score)>prev_error+error:
+                if score<prev_score and self._plateau is not None:
+                    # Peak at the middle of the plateau, offset by one step
+                    start,below,values=self._plateau
+                    values=values+[(score,error,above)]
+                    peak=(start+step-1)//2+1
+                    peak_score,peak_error,peak_above=values[peak-start]
+                    peak_below=below+sum(not value_above for value_score,value_error,value_above in values[:peak-start])
+                    onsets.extend(self._push_peak(peak,peak_score,peak_error,peak_below))
+
+                self._plateau=(step,self._below_count,[]) if score>prev_score else None
+
+        if self._plateau is not None:
+            self._plateau[2].append((score,error,above))
+
+        if not above:
+            self._below_count+=1
+            onsets.extend(self._end_period())
+
+        self._prev_score=(score,error)
+
+        return onsets
+
+    def _push_peak(self,peak,score,error,below):
+        if not score-error>self.threshold:
+            return []
+
+        tnum=self.start_tnum+peak*self.resolution
+
+        if not self.require_continuous:
+            return [tnum]
+
+        onsets=[]
+        if self._period is None or self._period[0]!=below:
+            onsets=self._end_period()
+            self._period=(below,-np.inf,[])
+
+        below,highest,candidates=self._period
+        highest=max(highest,score-error)
+
+        # A peak can only be chosen if no earlier one can be as high
+        if len(candidates)==0 or score+error>candidates[-1][1]:
+            candidates.append((tnum,score+error))
+
+        # Drop peaks that can no longer be the highest
+        while candidates[0][1]<highest:
+            candidates.pop(0)
+
+        self._period=(below,highest,candidates)
+
+        return onsets
+
+    def _end_period(self):
+        if self._period is None:
+            return []
+
+        tnum=self._period[2][0][0]
+        self._period=None
+
+        return [tnum]
+
+    def update(self,signatures,now):
+        """
+        Adds newly arrived onsets.
+
+        signatures: Dictionary of sequences of onset times (datetime,
+            datetime64, or seconds since epoch), keyed by signature type.
+            Onsets must be earlier than now, and no earlier than the now
+            passed to the previous call (or tmin).
+        now: Time up to which all onsets have been delivered
+
+        Returns an array of new substorm onsets, in seconds since epoch.
+        """
+
+        now_tnum=float(to_seconds(now,self.epoch))
+        if now_tnum<self._watermark:
+            raise ValueError('now must not decrease between calls to update')
+
+        steps=[]
+        names=[]
+        for name,times in signatures.items():
+            if self.signature_weights.get(name,1)<=0:
+                continue
+            tnums=np.atleast_1d(to_seconds(times,self.epoch))
+            if np.any(tnums<self._watermark) or np.any(tnums>=now_tnum):
+                raise ValueError('Onsets of {} are outside the interval since the last update'.format(name))
+            steps.append(np.floor((tnums-self.start_tnum)/self.resolution).astype(int))
+            names.extend([name]*len(tnums))
+
+        steps=np.concatenate([np.zeros(0,dtype=int)]+steps)
+        onsets=[]
+
+        # Add onsets in time order, computing each score once no further onset can change it
+        for i in np.argsort(steps,kind='mergesort'):
+            onsets.extend(self._finalize(steps[i]-self.half_width+1))
+            self._add_onset(names[i],steps[i])
+
+        complete_steps=int(np.floor((now_tnum-self.start_tnum)/self.resolution))
+        onsets.extend(self._finalize(complete_steps-self.half_width+1))
+
+        self._watermark=now_tnum
+
+        return np.array(onsets)
+
+    def flush(self,tmax):
+        """
+        Ends the stream at tmax, assuming there are no further onsets.
+
+        Returns an array of the remaining substorm onsets, in seconds since epoch.
+        """
+
+        onsets=self._finalize(len(_tnum_range(self.start_tnum,to_seconds(tmax,self.epoch),self.resolution,0)))
+        onsets.extend(self._end_period())
+
+        return np.array(onsets)
+
+def bin_onsets(substorm_tnums,bin_tnums):
+    """
+    Boolean array that is True for each bin in bin_tnums containing at least
+    one of substorm_tnums. The last bin is never set, as in
+    find_substorms_convolution.
+
+    substorm_tnums: Onset times
+    bin_tnums: Bin start times, in the same units
+    """
+
+    substorm_bin_inds=np.searchsorted(bin_tnums,substorm_tnums)
+    substorm_bin_inds=substorm_bin_inds[(substorm_bin_inds>0) & (substorm_bin_inds<len(bin_tnums))]-1
+
+    substorm_bins=np.zeros(len(bin_tnums),dtype=bool)
+    substorm_bins[substorm_bin_inds]=True
+
+    return substorm_bins
+
+def bin_segments(score_tnums,bin_tnums):
+    """
+    Divides a time series into bins.
+
+    score_tnums: Sample times of the series
+    bin_tnums: Bin start times
+
+    Returns arrays of start and stop indices such that the samples in bin k
+    are score_tnums[starts[k]:stops[k]]. Samples before the first bin are
+    assigned to the first bin.
+    """
+
+    split_inds=np.searchsorted(score_tnums,bin_tnums)
+    starts=np.concatenate([[0],split_inds[1:]]).astype(int)
+    stops=np.concatenate([split_inds[1:],[len(score_tnums)]]).astype(int)
+
+    return starts,stops
+
+def _uniform_segments(starts,stops):
+    """
+    Length of the segments if they are contiguous and all the same non-zero length, otherwise None.
+    """
+    if len(starts)==0:
+        return None
+    length=stops[0]-starts[0]
+    if length>0 and np.all(stops-starts==length) and np.all(starts[1:]==stops[:-1]):
+        return length
+    else:
+        return None
+
+def reduce_bins(values,starts,stops,ufunc=np.maximum,empty_value=np.nan):
+    """
+    Applies ufunc.reduce to values[starts[k]:stops[k]] for every segment k at
+    once, using ufunc.reduceat. Empty segments give empty_value.
+    """
+
+    values=np.asarray(values)
+    starts=np.asarray(starts,dtype=int)
+    stops=np.asarray(stops,dtype=int)
+
+    length=_uniform_segments(starts,stops)
+    if length is not None:
+        return ufunc.reduce(values[starts[0]:stops[-1]].reshape(len(starts),length),axis=1)
+
+    if len(values)==0:
+        return np.full(len(starts),empty_value)
+
+    # Reduce over [start,stop) pairs; the extra element keeps every index in range
+    padded=np.concatenate([values,values[:1]])
+    result=ufunc.reduceat(padded,np.ravel(np.column_stack([starts,stops])))[::2]
+
+    result=result.astype(np.result_type(result,empty_value))
+    result[stops<=starts]=empty_value
+
+    return result
+
+def argmax_bins(values,starts,stops):
+    """
+    Equivalent to starts[k]+np.argmax(values[starts[k]:stops[k]]) for every
+    segment k, for sorted, non-overlapping segments. As with np.argmax, the
+    first maximum is taken, or the first NaN if there is one. Empty segments
+    give -1.
+    """
+
+    values=np.asarray(values)
+    starts=np.asarray(starts,dtype=int)
+    stops=np.asarray(stops,dtype=int)
+
+    length=_uniform_segments(starts,stops)
+    if length is not None:
+        return starts+np.argmax(values[starts[0]:stops[-1]].reshape(len(starts),length),axis=1)
+
+    result=np.full(len(starts),-1,dtype=int)
+    nonempty=stops>starts
+    if not np.any(nonempty):
+        return result
+
+    # Segment containing each sample
+    inds=np.arange(len(values))
+    segment=np.searchsorted(starts[nonempty],inds,side='right')-1
+    in_segment=(segment>=0)
+    in_segment[in_segment]&=inds[in_segment]<stops[nonempty][segment[in_segment]]
+
+    nans=np.isnan(values)
+    segment_max=reduce_bins(np.where(nans,-np.inf,values),starts[nonempty],stops[nonempty])
+    is_max=in_segment & (values==segment_max[np.maximum(segment,0)])
+
+    no_match=len(values)
+    first_max=reduce_bins(np.where(is_max,inds,no_match),starts[nonempty],stops[nonempty],np.minimum)
+    first_nan=reduce_bins(np.where(nans,inds,no_match),starts[nonempty],stops[nonempty],np.minimum)
+
+    result[nonempty]=np.where(first_nan<no_match,first_nan,first_max)
+
+    return result
+
+def bin_maxima(scores,score_tnums,bin_tnums):
+    """
+    Maximum of scores within each bin, and the time at which it occurs
+    (the first, if it occurs more than once). Bins containing no scores
+    give NaN.
+
+    scores,score_tnums: Series and its sample times
+    bin_tnums: Bin start times, in the same units as score_tnums
+    """
+
+    starts,stops=bin_segments(score_tnums,bin_tnums)
+    max_inds=argmax_bins(scores,starts,stops)
+
+    empty=max_inds<0
+    bin_maxes=np.asarray(scores,dtype=float)[max_inds]
+    bin_maxtimes=np.asarray(score_tnums,dtype=float)[max_inds]
+    bin_maxes[empty]=np.nan
+    bin_maxtimes[empty]=np.nan
+
+    return bin_maxes,bin_maxtimes
+
+def bin_means(scores,score_tnums,bin_tnums):
+    """
+    Mean of scores within each bin. Bins containing no scores give NaN.
+    """
+
+    starts,stops=bin_segments(score_tnums,bin_tnums)
+    sums=reduce_bins(np.asarray(scores,dtype=float),starts,stops,np.add)
+
+    return sums/np.where(stops>starts,stops-starts,np.nan)
+
+def bin_time_above(scores,score_tnums,bin_tnums,threshold):
+    """
+    Time (in the units of score_tnums) for which scores exceed threshold within each bin.
+
+    Each sample is taken to last until the next one; the last sample is
+    given the same duration as the one before it.
+    """
+
+    score_tnums=np.asarray(score_tnums,dtype=float)
+    durations=np.diff(score_tnums)
+    durations=np.concatenate([durations,durations[-1:]])
+
+    starts,stops=bin_segments(score_tnums,bin_tnums)
+
+    return reduce_bins(np.where(np.asarray(scores)>threshold,durations,0),starts,stops,np.add,0)
+
 def find_substorms_convolution(signatures,threshold,signature_weights={},tstep=timedelta(0,1800),bandwidth=timedelta(0,60*10),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),convolution_resolution=timedelta(0,60),return_times=False,epoch=datetime(2005,1,1,tzinfo=UTC),require_continuous=True,method='convolution_onsets'):
 
-    bin_tnums=np.arange((tmin-epoch).total_seconds(),(tmax-epoch).total_seconds(),tstep.total_seconds())
+    bin_tnums=_tnum_range(tmin,tmax,tstep,epoch)
 
     if method=='convolution_onsets':
-    	substorm_tnums=find_convolution_onsets(signatures,threshold,signature_weights=signature_weights,bandwidth=bandwidth,convolution_resolution=convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch,require_continuous=require_continuous)
+        substorm_tnums=find_convolution_onsets(signatures,threshold,signature_weights=signature_weights,bandwidth=bandwidth,convolution_resolution=convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch,require_continuous=require_continuous)
 
-        substorm_bin_inds=np.searchsorted(bin_tnums,substorm_tnums)
-        substorm_bin_inds=substorm_bin_inds[(substorm_bin_inds>0) & (substorm_bin_inds<len(bin_tnums))]-1
-
-        substorm_bins=np.zeros(len(bin_tnums),dtype=bool)
-        substorm_bins[substorm_bin_inds]=True
+        substorm_bins=bin_onsets(substorm_tnums,bin_tnums)
 
     elif method=='bin_maxes':
 
         scores,score_tnums=convolved_substorm_scores(signatures,signature_weights,bandwidth,convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch)
-        split_inds=np.searchsorted(score_tnums,bin_tnums)
-        bin_maxes=np.zeros([len(bin_tnums)])
-        bin_maxtimes=np.zeros([len(bin_tnums)])
-
-        for ibin,(split_scores,split_tnums) in enumerate(zip(
-                np.split(scores,split_inds[1:]),
-                np.split(score_tnums,split_inds[1:]))):
-            max_ind=np.argmax(split_scores)
-            bin_maxes[ibin]=split_scores[max_ind]
-            bin_maxtimes[ibin]=split_tnums[max_ind]
+        bin_maxes,bin_maxtimes=bin_maxima(scores,score_tnums,bin_tnums)
 
         substorm_bins=(bin_maxes>=threshold)
         substorm_tnums=(bin_maxtimes[substorm_bins])
@@ -202,17 +1069,54 @@ def find_substorms_convolution(signatures,threshold,signature_weights={},tstep=t
         raise ValueError('Invalid method passed {} to find_substorms_convolution'.format(method))
 
     if return_times:
-        substorm_times=[epoch+timedelta(seconds=tnum) for tnum in substorm_tnums]
+        substorm_times=tnums_to_times(substorm_tnums,epoch)
         return substorm_bins,substorm_times
     else:
         return substorm_bins
 
-def find_substorms(signatures,threshold,signature_filters=None,mandatory_signatures=[],tstep=timedelta(0,1800),epoch=datetime(2005,1,1,tzinfo=UTC),return_times=False):
+def sweep_convolution_thresholds(signatures,thresholds,signature_weights={},tstep=timedelta(0,1800),bandwidth=timedelta(0,60*10),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),convolution_resolution=timedelta(0,60),epoch=datetime(2005,1,1,tzinfo=UTC),require_continuous=True,method='convolution_onsets'):
+    """
+    Evaluates find_substorms_convolution for a sequence of scalar thresholds,
+    computing the convolved scores only once.
+
+    Returns a boolean array of substorm bins with one row per threshold, and
+    a list containing the substorm times (seconds since epoch) for each
+    threshold.
+    """
+
+    bin_tnums=_tnum_range(tmin,tmax,tstep,epoch)
+
+    scores,score_tnums,error=convolved_substorm_scores(signatures,signature_weights,bandwidth,convolution_resolution,tmin=tmin,tmax=tmax,epoch=epoch,return_error=True)
+
+    if method=='convolution_onsets':
+        substorm_tnums=[score_tnums[onset_inds] for onset_inds in
+                        sweep_convolution_scores(scores,thresholds,require_continuous,error)]
+        substorm_bins=np.array([bin_onsets(tnums,bin_tnums) for tnums in substorm_tnums],dtype=bool).reshape(len(substorm_tnums),len(bin_tnums))
+
+    elif method=='bin_maxes':
+        bin_maxes,bin_maxtimes=bin_maxima(scores,score_tnums,bin_tnums)
+        substorm_bins=bin_maxes>=np.asarray(thresholds)[:,np.newaxis]
+        substorm_tnums=[bin_maxtimes[bins] for bins in substorm_bins]
+
+    else:
+        raise ValueError('Invalid method passed {} to sweep_convolution_thresholds'.format(method))
+
+    return substorm_bins,substorm_tnums
+
+def find_substorms(signatures,threshold,signature_filters=None,mandatory_signatures=[],tstep=timedelta(0,1800),epoch=datetime(2005,1,1,tzinfo=UTC),return_times=False,sparse=False,bins=None):
+    """
+    Finds bins in which at least threshold signatures have onsets.
+
+    sparse: If True, use a SparseGrid, and return a sorted array of
+        substorm bin indices instead of a boolean array. The times returned
+        with return_times are then those of the substorm bins only.
+    bins: TimeBins passed to make_grid
+    """
 
     if signature_filters is None:
         signature_filters=signatures.keys()
 
-    retvals=make_grid(signatures,signature_filters=signature_filters,tstep=tstep,return_times=return_times,epoch=epoch)
+    retvals=make_grid(signatures,signature_filters=signature_filters,tstep=tstep,return_times=return_times,epoch=epoch,sparse=sparse,bins=bins)
     if return_times:
         grid,times,keys=retvals
     else:
@@ -223,7 +1127,10 @@ def find_substorms(signatures,threshold,signature_filters=None,mandatory_signatu
     substorms=substorm_occurrences(grid,threshold,mandatory_signature_inds)
 
     if return_times:
-        if len(mandatory_signature_inds)>0:
+        if sparse:
+            rows=mandatory_signature_inds if len(mandatory_signature_inds)>0 else None
+            times=grid.min_times(substorms,rows)
+        elif len(mandatory_signature_inds)>0:
             times=np.ma.min(times[mandatory_signature_inds,:],axis=0)
         else:
             times=np.ma.min(times,axis=0)
@@ -1,13 +1,106 @@
 import numpy as np
 from matplotlib.dates import date2num,num2date
 
-def borovsky_id_algorithm(al_values):
+def _window_sums(values,starts,stops):
+    """
+    Sums of values[start:stop] for many windows at once, computed from prefix sums.
+
+    Returns the sums and a bound on how far each may differ from np.sum applied
+    to the same slice. Windows containing NaN sum to NaN, as with np.sum.
+    """
+
+    values=np.asarray(values)
+    finite_values=values.astype(float)
+    nans=np.isnan(finite_values)
+    finite_values[nans]=0
+
+    prefix=np.concatenate([[0],np.cumsum(finite_values)])
+    abs_prefix=np.concatenate([[0],np.cumsum(np.abs(finite_values))])
+    nan_prefix=np.concatenate([[0],np.cumsum(nans)])
+
+    sums=prefix[stops]-prefix[starts]
+    sums[nan_prefix[stops]>nan_prefix[starts]]=np.nan
+
+    # Rounding error of the prefix sums, plus that of np.sum in the precision of the input
+    if np.issubdtype(values.dtype,np.floating):
+        eps=np.finfo(values.dtype).eps
+    else:
+        eps=0
+    error=2*len(values)*np.finfo(float).eps*abs_prefix[-1] \
+        + (stops-starts)*eps*(abs_prefix[stops]-abs_prefix[starts])
+
+    return sums,error
+
+def _borovsky_integral_test(al_values,inds):
+    """
+    Evaluates the Borovsky (2017) 45-minute integral criterion for each index in inds.
+    """
+
+    n=len(al_values)
+    before_starts=np.maximum(inds-45,0)
+    after_stops=np.minimum(inds+45,n)
+
+    before_integral,before_error=_window_sums(al_values,before_starts,inds)
+    after_integral,after_error=_window_sums(al_values,inds,after_stops)
+
+    satisfied=after_integral < before_integral*1.5
+
+    # Where the prefix sums are too close to call, repeat the comparison with np.sum
+    ambiguous=np.where(np.abs(after_integral-before_integral*1.5)
+                       <= 2*(after_error+1.5*before_error))[0]
+    for k in ambiguous:
+        before_integral=np.sum(al_values[before_starts[k]:inds[k]])
+        after_integral=np.sum(al_values[inds[k]:after_stops[k]])
+        satisfied[k]=after_integral < before_integral*1.5
+
+    return satisfied
+
+def borovsky_id_algorithm(al_values,method='vectorized'):
     """
     Identifies candidate substorm onsets from the AL index using the procedure described in Borovsky (2017).
 
     al_values: A sequence of AL index values in nT, with a time cadence of 1 minute
+    method: 'vectorized' evaluates the selection criteria for the whole series
+        at once using prefix sums; 'loop' examines one descent interval at a
+        time. Both return the same indices.
     """
 
+    if method=='vectorized':
+        return _borovsky_id_vectorized(al_values)
+    elif method=='loop':
+        return _borovsky_id_loop(al_values)
+    else:
+        raise ValueError('Invalid method passed {} to borovsky_id_algorithm'.format(method))
+
+def _borovsky_id_vectorized(al_values):
+
+    al_values=np.asarray(al_values)
+
+    # Find indices where al_values decreases by 150 or more in 15 minutes
+    descent_intervals=np.where((al_values[:-15]-al_values[15:])>=150)[0]
+
+    if len(descent_intervals)==0:
+        return []
+
+    # Ignore intervals that are within 30 minutes of a previous interval
+    descent_intervals=descent_intervals[
+        np.concatenate([[True],np.diff(descent_intervals)>=30])]
+
+    # Find decreases greater than 10 nT in 2 minutes, in the first 13 minutes of each interval
+    candidate_inds=descent_intervals[:,np.newaxis]+np.arange(13)
+    is_candidate=(al_values[candidate_inds]-al_values[candidate_inds+2])>10
+
+    # Apply the integral criterion to the candidates
+    is_candidate[is_candidate]=_borovsky_integral_test(al_values,candidate_inds[is_candidate])
+
+    # Take the first candidate satisfying all criteria in each descent interval
+    has_event=np.any(is_candidate,axis=1)
+    event_inds=descent_intervals[has_event]+np.argmax(is_candidate[has_event],axis=1)
+
+    return list(event_inds)
+
+def _borovsky_id_loop(al_values):
+
     event_inds=[]
     i=0
 
@@ -47,12 +140,75 @@ def borovsky_id_algorithm(al_values):
 
     return event_inds
 
-def supermag_id_algorithm(al_values,threshold_1min=-15,threshold_2min=-30,threshold_3min=-45,threshold_30min=-100,min_time_between_events=20):
+def supermag_id_algorithm(al_values,threshold_1min=-15,threshold_2min=-30,threshold_3min=-45,threshold_30min=-100,min_time_between_events=20,method='vectorized'):
     """
     Identifies candidate substorm onsets from the AL index using the procedure described in Newell (2011).
 
     al_values: A sequence of AL index values in nT, with a time cadence of 1 minute
+    method: 'vectorized' evaluates the threshold criteria for every index at
+        once and then applies min_time_between_events to the surviving
+        candidates; 'loop' steps through the series one minute at a time. Both
+        return the same indices.
+    """
+
+    if method=='vectorized':
+        candidates=np.where(_supermag_candidates(
+            al_values,threshold_1min,threshold_2min,threshold_3min,threshold_30min))[0]
+        return _select_separated(candidates,min_time_between_events)
+    elif method=='loop':
+        return _supermag_id_loop(al_values,threshold_1min,threshold_2min,threshold_3min,threshold_30min,min_time_between_events)
+    else:
+        raise ValueError('Invalid method passed {} to supermag_id_algorithm'.format(method))
+
+def _supermag_candidates(al_values,threshold_1min,threshold_2min,threshold_3min,threshold_30min):
     """
+    Evaluates the Newell (2011) threshold criteria at every index that has 30
+    minutes of data following it.
+
+    Returns a boolean array of length len(al_values)-30.
+    """
+
+    al_values=np.asarray(al_values)
+    n=len(al_values)-30
+
+    if n<=0:
+        return np.zeros(0,dtype=bool)
+
+    al0=al_values[:n]
+
+    # Criteria are written as negations of the loop's rejection tests so that NaN is treated the same way
+    satisfied=~(al_values[1:n+1]-al0 >= threshold_1min)
+    satisfied&=~(al_values[2:n+2]-al0 >= threshold_2min)
+    satisfied&=~(al_values[3:n+3]-al0 >= threshold_3min)
+
+    # Rolling 27-minute mean from 4 to 30 minutes after each index
+    starts=np.arange(n)+4
+    window_sums,window_error=_window_sums(al_values,starts,starts+27)
+    mean_change=window_sums/27-al0
+    ambiguous=np.where(satisfied & (np.abs(mean_change-threshold_30min) <= 2*window_error/27))[0]
+    satisfied&=~(mean_change >= threshold_30min)
+
+    # Where the rolling mean is too close to call, repeat the comparison with np.average
+    for i in ambiguous:
+        satisfied[i]=not (np.average(np.array(al_values[i+4:i+31])) - al0[i] >= threshold_30min)
+
+    return satisfied
+
+def _select_separated(candidates,min_separation):
+    """
+    Greedily selects candidates from a sorted sequence, skipping any that
+    follow the last selected one by less than min_separation.
+    """
+
+    selected=[]
+    k=0
+    while k<len(candidates):
+        selected.append(candidates[k])
+        k=max(np.searchsorted(candidates,candidates[k]+min_separation),k+1)
+
+    return selected
+
+def _supermag_id_loop(al_values,threshold_1min,threshold_2min,threshold_3min,threshold_30min,min_time_between_events):
 
     event_inds=[]
     i=0
@@ -75,3 +231,187 @@ def supermag_id_algorithm(al_values,threshold_1min=-15,threshold_2min=-30,thresh
         i+=min_time_between_events
 
     return event_inds
+
+class BorovskyOnsetDetector(object):
+    """
+    Streaming version of borovsky_id_algorithm, for AL values that arrive a
+    few at a time.
+
+    Only the samples still needed are kept: those from 45 minutes before the
+    earliest undecided descent interval, and the last 15 minutes for finding
+    new ones. An onset is returned once the 45-minute integral following it
+    is complete. The onsets returned by update and finish are the indices
+    borovsky_id_algorithm returns for the concatenated values.
+    """
+
+    def __init__(self):
+        self._buffer=None
+
+        # Index in the stream of self._buffer[0]
+        self._offset=0
+
+        # First index not yet tested as the start of a descent interval, and the last one found
+        self._next_descent=0
+        self._last_descent=None
+
+        # Descent intervals whose onsets have not been decided yet
+        self._pending=[]
+
+    def _decide(self,idescent,final):
+        """
+        Finds the onset in a descent interval, as in _borovsky_id_loop.
+
+        Returns whether the interval could be decided with the samples
+        received so far (always True if final is True), and the onset index
+        (None if there is none).
+        """
+
+        al_values=self._buffer
+        offset=self._offset
+        n=offset+len(al_values)
+
+        for ind in range(idescent,idescent+13):
+
+            # Find decreases greater than 10 nT in 2 minutes
+            if not (al_values[ind-offset]-al_values[ind+2-offset])>10:
+                continue
+
+            if ind+45>n and not final:
+                return False,None
+
+            before_integral=np.sum(al_values[max(ind-45,0)-offset:ind-offset])
+            after_integral=np.sum(al_values[ind-offset:min(ind+45,n)-offset])
+
+            if after_integral < before_integral*1.5:
+                return True,ind
+
+        return True,None
+
+    def _decide_pending(self,final):
+        event_inds=[]
+
+        while len(self._pending)>0:
+            decided,event_ind=self._decide(self._pending[0],final)
+            if not decided:
+                break
+            self._pending.pop(0)
+            if event_ind is not None:
+                event_inds.append(event_ind)
+
+        return event_inds
+
+    def update(self,al_values):
+        """
+        Adds AL values (nT, 1-minute cadence) following those already received.
+
+        Returns a list of the onset indices (counted from the start of the
+        stream) that can now be decided.
+        """
+
+        al_values=np.asarray(al_values)
+        if self._buffer is None:
+            self._buffer=al_values
+        else:
+            self._buffer=np.concatenate([self._buffer,al_values])
+
+        n=self._offset+len(self._buffer)
+
+        # Find indices where al_values decreases by 150 or more in 15 minutes
+        if n-15>self._next_descent:
+            segment=self._buffer[self._next_descent-self._offset:]
+            descent_intervals=np.where((segment[:-15]-segment[15:])>=150)[0]+self._next_descent
+
+            for idescent in descent_intervals:
+                # Ignore intervals that are within 30 minutes of a previous interval
+                if self._last_descent is None or idescent-self._last_descent>=30:
+                    self._pending.append(idescent)
+                self._last_descent=idescent
+
+            self._next_descent=n-15
+
+        event_inds=self._decide_pending(False)
+
+        # Drop samples that are no longer needed
+        if len(self._pending)>0:
+            keep_from=self._pending[0]-45
+        else:
+            keep_from=self._next_descent-45
+        if keep_from>self._offset:
+            self._buffer=np.array(self._buffer[keep_from-self._offset:])
+            self._offset=keep_from
+
+        return event_inds
+
+    def finish(self):
+        """
+        Ends the stream, deciding the remaining descent intervals with the
+        integrals truncated at the last sample.
+
+        Returns a list of the remaining onset indices.
+        """
+
+        if self._buffer is None:
+            return []
+
+        return self._decide_pending(True)
+
+class SupermagOnsetDetector(object):
+    """
+    Streaming version of supermag_id_algorithm, for AL values that arrive a
+    few at a time.
+
+    Each index is tested once the 30 minutes of data following it have
+    arrived, so only the last 30 samples are kept between calls. The onsets
+    returned by update are the indices supermag_id_algorithm returns for
+    the concatenated values.
+
+    threshold_1min,threshold_2min,threshold_3min,threshold_30min,min_time_between_events:
+        As for supermag_id_algorithm
+    """
+
+    def __init__(self,threshold_1min=-15,threshold_2min=-30,threshold_3min=-45,threshold_30min=-100,min_time_between_events=20):
+        self.thresholds=(threshold_1min,threshold_2min,threshold_3min,threshold_30min)
+        self.min_time_between_events=min_time_between_events
+
+        self._buffer=None
+
+        # Index in the stream of self._buffer[0]
+        self._offset=0
+
+        self._last_event=None
+
+    def update(self,al_values):
+        """
+        Adds AL values (nT, 1-minute cadence) following those already received.
+
+        Returns a list of new onset indices, counted from the start of the stream.
+        """
+
+        al_values=np.asarray(al_values)
+        if self._buffer is None:
+            self._buffer=al_values
+        else:
+            self._buffer=np.concatenate([self._buffer,al_values])
+
+        candidates=np.where(_supermag_candidates(self._buffer,*self.thresholds))[0]+self._offset
+
+        # Skip candidates less than min_time_between_events after the last event, as in _select_separated
+        event_inds=[]
+        for candidate in candidates:
+            if self._last_event is None or candidate>=self._last_event+self.min_time_between_events:
+                event_inds.append(candidate)
+                self._last_event=candidate
+
+        # Keep the samples that have not yet been tested, which lack 30 minutes of data following them
+        ntested=max(len(self._buffer)-30,0)
+        self._buffer=np.array(self._buffer[ntested:])
+        self._offset+=ntested
+
+        return event_inds
+
+    def finish(self):
+        """
+        Ends the stream. The last 30 samples cannot be onsets, so this returns an empty list.
+        """
+
+        return []
@@ -38,41 +38,211 @@ def check_ranges(i,arr,ranges,op=np.max):
 
     return satisfied
 
+def range_extrema(arr,offs_min,offs_max,op=np.max):
+    """
+    Computes op(arr[i+offs_min:i+offs_max]) for every index i of arr, with
+    each window clipped to the bounds of arr as in check_ranges.
+
+    arr: Sequence of values
+    offs_min,offs_max: Window bounds relative to each index
+    op: np.max or np.min
+
+    Returns the range extrema and a boolean array that is True where the
+    clipped window is empty. Windows containing NaN give NaN, as op would.
+    """
+    from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+    if op is np.max:
+        extremum_filter=maximum_filter1d
+        fill=-np.inf
+    elif op is np.min:
+        extremum_filter=minimum_filter1d
+        fill=np.inf
+    else:
+        raise ValueError('range_extrema only supports np.max and np.min')
+
+    arr=np.array(arr,dtype=float)
+    n=len(arr)
+    inds=np.arange(n)
+
+    imin=np.maximum(inds+offs_min,0)
+    imax=np.minimum(inds+offs_max,n)
+    empty=imin>imax-1
+
+    width=offs_max-offs_min
+    if width<1 or n==0:
+        return np.full(n,np.nan),np.ones(n,dtype=bool)
+
+    nans=np.isnan(arr)
+    arr[nans]=fill
+
+    # Pad so that clipped windows see only the fill value outside arr
+    padded=np.concatenate([np.full(width,fill),arr,np.full(width,fill)])
+    filtered=extremum_filter(padded,width,mode='constant',cval=fill)
+
+    # filtered[j] is the extremum of padded[j-width//2:j-width//2+width]
+    window_starts=np.clip(inds+offs_min+width,0,len(padded)-width)
+    extrema=filtered[window_starts+width//2]
+
+    # Propagate NaN from any window that contains one
+    nan_prefix=np.concatenate([[0],np.cumsum(nans)])
+    nan_counts=nan_prefix[np.clip(imax,0,n)]-nan_prefix[np.minimum(imin,n)]
+    extrema[nan_counts>0]=np.nan
+
+    extrema[empty]=np.nan
+
+    return extrema,empty
+
+def check_ranges_vectorized(inds,arr,ranges,op=np.max):
+    """
+    Equivalent to check_ranges applied to each index in inds, using
+    range_extrema to evaluate each window specification for all indices at
+    once.
+
+    Returns a boolean array with one element per index in inds.
+    """
+
+    inds=np.asarray(inds,dtype=int)
+    arr=np.asarray(arr)
+    satisfied=np.ones(len(inds),dtype=bool)
+
+    for offs_min,offs_max,threshold_min,threshold_max in ranges:
+        range_lim,empty=range_extrema(arr,offs_min,offs_max,op)
+        range_change=range_lim[inds]-arr[inds]
+
+        # Not enough points to evaluate
+        satisfied&=~empty[inds]
+
+        # Comparisons are negated so that NaN satisfies the threshold, as in check_ranges
+        if threshold_min is not None:
+            satisfied&=~(range_change<threshold_min)
+
+        if threshold_max is not None:
+            satisfied&=~(range_change>threshold_max)
+
+    return satisfied
+
+def _windowed_argextremum(values,lo,hi,op=np.argmax,max_elements=1000000):
+    """
+    Computes lo[k]+op(values[lo[k]:hi[k]]) for each window k, where op is
+    np.argmax or np.argmin. All windows must be non-empty. As with op, the
+    first occurrence of the extremum is taken, and a window containing NaN
+    gives the index of its first NaN.
+
+    Windows may overlap. They are gathered into a flat array and reduced with
+    ufunc.reduceat, at most max_elements samples at a time.
+    """
+
+    values=np.asarray(values)
+    lo=np.asarray(lo,dtype=int)
+    hi=np.asarray(hi,dtype=int)
+
+    if op is np.argmax:
+        sign=1
+    elif op is np.argmin:
+        sign=-1
+    else:
+        raise ValueError('_windowed_argextremum only supports np.argmax and np.argmin')
+
+    lengths=hi-lo
+    if np.any(lengths<1):
+        raise ValueError('All windows must be non-empty')
+
+    result=np.zeros(len(lo),dtype=int)
+    cumulative_lengths=np.cumsum(lengths)
+
+    start=0
+    while start<len(lo):
+        elements_before=cumulative_lengths[start]-lengths[start]
+        stop=max(np.searchsorted(cumulative_lengths,elements_before+max_elements,side='right'),start+1)
+
+        chunk_lo=lo[start:stop]
+        chunk_lengths=lengths[start:stop]
+        offsets=np.concatenate([[0],np.cumsum(chunk_lengths)[:-1]])
+        window_ids=np.repeat(np.arange(len(chunk_lo)),chunk_lengths)
+        flat_inds=np.arange(np.sum(chunk_lengths))
+        gathered=values[flat_inds-offsets[window_ids]+chunk_lo[window_ids]]*sign
+
+        nans=np.isnan(gathered)
+        gathered[nans]=-np.inf
+
+        # First position of the window maximum
+        window_max=np.maximum.reduceat(gathered,offsets)
+        is_max=gathered==window_max[window_ids]
+        first_max=np.minimum.reduceat(np.where(is_max,flat_inds,len(flat_inds)),offsets)
+
+        # First NaN, which takes precedence
+        first_nan=np.minimum.reduceat(np.where(nans,flat_inds,len(flat_inds)),offsets)
+        first=np.where(first_nan<len(flat_inds),first_nan,first_max)
+
+        result[start:stop]=first-offsets+chunk_lo
+        start=stop
+
+    return result
+
 def find_dipolarizations_fu2012(numtimes,bx,by,bz):
     """
     Dipolarization ID algorithm described in Fu (2012). Only the magnetic field criteria are used, not the pressure/velocity criteria.
 
+    The 3-minute window is stepped along the series in 1.5-minute increments.
+    Window bounds are found with searchsorted and the extrema within every
+    window are computed together, so the cost is linear in the length of the
+    series. Sampling may be irregular; windows containing no samples are
+    skipped.
+
     Arguments:
-    numtimes: Numeric time in the format returned by matplotlib's date2num
+    numtimes: Numeric time in the format returned by matplotlib's date2num, in increasing order
     bx,by,bz: Magnetic field components in GSM coordinates
     """
 
+    numtimes=np.asarray(numtimes)
+    bx=np.asarray(bx)
+    by=np.asarray(by)
+    bz=np.asarray(bz)
+
     theta=np.arctan2(bz,np.sqrt(bx**2+by**2))
-    window_pos=numtimes[0]
     window_width=3.0/1440
     window_step=1.5/1440
+
+    # Window positions, accumulated one step at a time so they match stepping a single window along the series.
+    # Two extra steps take the last position past last_pos.
+    last_pos=numtimes[-1]-window_width
+    nsteps=max(int((last_pos-numtimes[0])/window_step),0)+2
+    window_pos=np.add.accumulate(np.concatenate([[numtimes[0]],np.full(nsteps,window_step)]))
+    window_pos=window_pos[window_pos<=last_pos]
+
+    # Window k contains the samples lo[k]:hi[k]
+    lo=np.searchsorted(numtimes,window_pos,side='right')
+    hi=np.searchsorted(numtimes,window_pos+window_width,side='right')
+
+    # Skip empty windows, and windows where NaN theta would fail the criteria
+    theta_nan_prefix=np.concatenate([[0],np.cumsum(np.isnan(theta))])
+    valid=(hi>lo) & (theta_nan_prefix[hi]==theta_nan_prefix[lo])
+    lo=lo[valid]
+    hi=hi[valid]
+
+    theta_argmax=_windowed_argextremum(theta,lo,hi,np.argmax)
+    theta_argmin=_windowed_argextremum(theta,lo,hi,np.argmin)
+    theta_max=theta[theta_argmax]
+    theta_min=theta[theta_argmin]
+
+    # Theta must reach 45 deg or more and increase by 10 deg in the interval
+    candidates=(theta_max>=np.pi/4) & \
+        (theta_max-theta_min>10*np.pi/180) & \
+        (theta_argmax>theta_argmin)
+
+    # Candidate dipolarization time occurs at minimum bz in window
+    candidate_times=numtimes[_windowed_argextremum(bz,lo[candidates],hi[candidates],np.argmin)]
+
     dip_times=[]
 
-    while window_pos<=numtimes[-1]-window_width:
-        in_window=(numtimes>window_pos)&(numtimes<=window_pos+window_width)
-        theta_in_window=theta[in_window]
-        theta_max=np.max(theta_in_window)
-        
-        # Theta must reach 45 deg or more and increase by 10 deg in the interval
-        if theta_max>=np.pi/4 and \
-           theta_max-np.min(theta_in_window)>10*np.pi/180 and\
-           np.argmax(theta_in_window)>np.argmin(theta_in_window):
-            
-            # Candidate dipolarization time occurs at minimum bz in window
-            dip_time=numtimes[in_window][np.argmin(bz[in_window])]
-
-            # Only record if dipolarization follows the last one by at least 30 sec
-            if len(dip_times)==0 or dip_time-dip_times[-1]>0.5/1440:
-                dip_times.append(dip_time)
-                
-        window_pos+=window_step
+    for dip_time in candidate_times:
+
+        # Only record if dipolarization follows the last one by at least 30 sec
+        if len(dip_times)==0 or dip_time-dip_times[-1]>0.5/1440:
+            dip_times.append(dip_time)
 
-    return dip_times 
+    return dip_times
 
 def find_dipolarizations(times,bz_values,threshold_m5min=-1,threshold_m10min=-2,threshold_1min=0.5,threshold_2min=1,threshold_3min=2,threshold_30min=8,threshold_60min=15,min_time_between_events=20):
     minutes_from_start=(date2num(times)-date2num(times[0]))*1440
@@ -168,15 +338,27 @@ def find_dipolarizations_br_bz_theta(times,br,bz,theta):
     if np.max(np.abs(deltas-1))>1e-2:
         raise ValueError('Times must be in 1-minute intervals')
 
+    candidates=find_dipolarization_candidates(br,bz,theta)
+
+    return merge_dipolarization_candidates(candidates,bz,theta)
+
+def find_dipolarization_candidates(br,bz,theta):
+    """
+    Finds minima of theta at which the Bz and Br threshold criteria of
+    find_dipolarizations_br_bz_theta are satisfied.
+
+    br,bz,theta: Series with a time cadence of 1 minute
+
+    The criteria at each index depend only on values from 10 minutes before
+    to 60 minutes after it, so a long series can be processed in overlapping
+    pieces.
+    """
+
     theta_local_mins=np.where((theta[2:]>theta[1:-1]) &
                               (theta[:-2]>theta[1:-1]))[0]+1
 
     br_abs=np.abs(br)
     
-    event_times=[]
-    event_inds=[]
-    i=20
-
     bz_max_ranges=(
         #(-10,0,0,None),
         #(-5,0,0,None),
@@ -221,45 +403,62 @@ def find_dipolarizations_br_bz_theta(times,br,bz,theta):
         #(10,30,3,None),
     )
 
-    for i in theta_local_mins:
-    #for i in range(len(times)):
-
-        bz_min_satisfied=check_ranges(i,bz,bz_min_ranges,np.min)
-        bz_min_satisfied=True
-        bz_max_satisfied=check_ranges(i,bz,bz_max_ranges,np.max)
-        #bz_max_satisfied=True
-        br_min_satisfied=check_ranges(i,br_abs,br_min_ranges,np.min)
-        #br_min_satisfied=True
-        br_max_satisfied=check_ranges(i,br_abs,br_max_ranges,np.max)
-        theta_min_satisfied=check_ranges(i,theta,theta_min_ranges,np.min)
-        theta_min_satisfied=True
-        theta_max_satisfied=check_ranges(i,theta,theta_max_ranges,np.max)
-        theta_max_satisfied=True
-
-        thresholds_satisfied=(bz_max_satisfied and bz_min_satisfied
-            and br_min_satisfied and br_max_satisfied
-            and theta_max_satisfied
-        )
-        
-        if thresholds_satisfied:
-            # Possible dipolarization onset, check for duplicates
+    bz_min_satisfied=check_ranges_vectorized(theta_local_mins,bz,bz_min_ranges,np.min)
+    bz_min_satisfied=True
+    bz_max_satisfied=check_ranges_vectorized(theta_local_mins,bz,bz_max_ranges,np.max)
+    #bz_max_satisfied=True
+    br_min_satisfied=check_ranges_vectorized(theta_local_mins,br_abs,br_min_ranges,np.min)
+    #br_min_satisfied=True
+    br_max_satisfied=check_ranges_vectorized(theta_local_mins,br_abs,br_max_ranges,np.max)
+    theta_min_satisfied=check_ranges_vectorized(theta_local_mins,theta,theta_min_ranges,np.min)
+    theta_min_satisfied=True
+    theta_max_satisfied=check_ranges_vectorized(theta_local_mins,theta,theta_max_ranges,np.max)
+    theta_max_satisfied=True
+
+    thresholds_satisfied=(bz_max_satisfied & bz_min_satisfied
+        & br_min_satisfied & br_max_satisfied
+        & theta_max_satisfied
+    )
+
+    return theta_local_mins[thresholds_satisfied]
 
-            if len(event_inds)==0 or i-event_inds[-1]>60:
-                # Too far in time to consider duplicate, keep event
+def merge_dipolarization_candidates(candidates,bz,theta,event_inds=None,offset=0):
+    """
+    Merges duplicate dipolarization candidates, in order.
+
+    candidates: Increasing candidate indices, as returned by find_dipolarization_candidates
+    bz,theta: Series from which the candidates were found, or a piece of them starting at index offset
+    event_inds: Events found so far, which the candidates follow. The list is
+        extended in place, and its last element may be replaced by a later
+        candidate. For each candidate, bz and theta must cover the 60 minutes
+        before it and the 60 minutes after it.
+    offset: Index in the full series of bz[0] and theta[0]
+
+    Returns event_inds.
+    """
+
+    if event_inds is None:
+        event_inds=[]
+
+    for i in candidates:
+        # Possible dipolarization onset, check for duplicates
+
+        if len(event_inds)==0 or i-event_inds[-1]>60:
+            # Too far in time to consider duplicate, keep event
+            event_inds.append(i)
+        else:
+            # Possible duplicate
+
+            # Make sure Bz peaked in between
+            max_bz_between=np.max(bz[event_inds[-1]-offset:i-offset])
+            max_bz_after=np.max(bz[i-offset:i-offset+60])
+            if (max_bz_between-bz[i-offset])>(max_bz_after-bz[i-offset])*0.25:
+                # Between peak is more than 25% of what came after, add event to list
                 event_inds.append(i)
             else:
-                # Possible duplicate
-
-                # Make sure Bz peaked in between
-                max_bz_between=np.max(bz[event_inds[-1]:i])
-                max_bz_after=np.max(bz[i:i+60])
-                if (max_bz_between-bz[i])>(max_bz_after-bz[i])*0.25:
-                    # Between peak is more than 25% of what came after, add event to list
-                    event_inds.append(i)
-                else:
-                    # Candidate event is a duplicate. Take the lowest minimum theta of the two as the event onset
-                    if theta[i]<theta[event_inds[-1]]:
-                        event_inds[-1]=i
-                    
+                # Candidate event is a duplicate. Take the lowest minimum theta of the two as the event onset
+                if theta[i-offset]<theta[event_inds[-1]-offset]:
+                    event_inds[-1]=i
+                
 
     return event_inds
@@ -2,6 +2,11 @@ import numpy as np
 from matplotlib.dates import date2num,num2date
 from datetime import datetime, timedelta
 from pytz import UTC
+from substorm_utils.event_id.dipolarizations import check_ranges_vectorized
+
+# find_dipolarizations_fu2012 now lives in dipolarizations; imported here so
+# existing imports from this module keep working
+from substorm_utils.event_id.dipolarizations import find_dipolarizations_fu2012
 
 def highpass(data,period=1440):
     import scipy.signal as signal
@@ -38,42 +43,6 @@ def check_ranges(i,arr,ranges,op=np.max):
 
     return satisfied
 
-def find_dipolarizations_fu2012(numtimes,bx,by,bz):
-    """
-    Dipolarization ID algorithm described in Fu (2012). Only the magnetic field criteria are used, not the pressure/velocity criteria.
-
-    Arguments:
-    numtimes: Numeric time in the format returned by matplotlib's date2num
-    bx,by,bz: Magnetic field components in GSM coordinates
-    """
-
-    theta=np.arctan2(bz,np.sqrt(bx**2+by**2))
-    window_pos=numtimes[0]
-    window_width=3.0/1440
-    window_step=1.5/1440
-    dip_times=[]
-
-    while window_pos<=numtimes[-1]-window_width:
-        in_window=(numtimes>window_pos)&(numtimes<=window_pos+window_width)
-        theta_in_window=theta[in_window]
-        theta_max=np.max(theta_in_window)
-        
-        # Theta must reach 45 deg or more and increase by 10 deg in the interval
-        if theta_max>=np.pi/4 and \
-           theta_max-np.min(theta_in_window)>10*np.pi/180 and\
-           np.argmax(theta_in_window)>np.argmin(theta_in_window):
-            
-            # Candidate dipolarization time occurs at minimum bz in window
-            dip_time=numtimes[in_window][np.argmin(bz[in_window])]
-
-            # Only record if dipolarization follows the last one by at least 30 sec
-            if len(dip_times)==0 or dip_time-dip_times[-1]>0.5/1440:
-                dip_times.append(dip_time)
-                
-        window_pos+=window_step
-
-    return dip_times 
-
 def find_dipolarizations(times,bz_values,threshold_m5min=-1,threshold_m10min=-2,threshold_1min=0.5,threshold_2min=1,threshold_3min=2,threshold_30min=8,threshold_60min=15,min_time_between_events=20):
     minutes_from_start=(date2num(times)-date2num(times[0]))*1440
     deltas=minutes_from_start[1:]-minutes_from_start[:-1]
@@ -225,29 +194,25 @@ def find_dipolarizations_br_bz_theta(times,br,bz,theta):
         #(10,30,3,None),
     )
 
-    for i in theta_local_mins:
-    #for i in range(len(times)):
-
-        bz_min_satisfied=check_ranges(i,bz_filtered,bz_min_ranges,np.min)
-        bz_min_satisfied=True
-        bz_max_satisfied=check_ranges(i,bz_filtered,bz_max_ranges,np.max)
-        #bz_max_satisfied=True
-        br_min_satisfied=check_ranges(i,br_filtered,br_min_ranges,np.min)
-        #br_min_satisfied=True
-        br_max_satisfied=check_ranges(i,br_filtered,br_max_ranges,np.max)
-        theta_min_satisfied=check_ranges(i,theta,theta_min_ranges,np.min)
-        theta_min_satisfied=True
-        theta_max_satisfied=check_ranges(i,theta,theta_max_ranges,np.max)
-        theta_max_satisfied=True
-
-        thresholds_satisfied=(bz_max_satisfied and bz_min_satisfied
-            and br_min_satisfied and br_max_satisfied
-            and theta_max_satisfied
-        )
-        
-        if thresholds_satisfied:
-            # All thresholds were satisfied, add to list
-            event_inds.append(i)
+    bz_min_satisfied=check_ranges_vectorized(theta_local_mins,bz_filtered,bz_min_ranges,np.min)
+    bz_min_satisfied=True
+    bz_max_satisfied=check_ranges_vectorized(theta_local_mins,bz_filtered,bz_max_ranges,np.max)
+    #bz_max_satisfied=True
+    br_min_satisfied=check_ranges_vectorized(theta_local_mins,br_filtered,br_min_ranges,np.min)
+    #br_min_satisfied=True
+    br_max_satisfied=check_ranges_vectorized(theta_local_mins,br_filtered,br_max_ranges,np.max)
+    theta_min_satisfied=check_ranges_vectorized(theta_local_mins,theta,theta_min_ranges,np.min)
+    theta_min_satisfied=True
+    theta_max_satisfied=check_ranges_vectorized(theta_local_mins,theta,theta_max_ranges,np.max)
+    theta_max_satisfied=True
+
+    thresholds_satisfied=(bz_max_satisfied & bz_min_satisfied
+        & br_min_satisfied & br_max_satisfied
+        & theta_max_satisfied
+    )
+
+    # All thresholds were satisfied, add to list
+    event_inds=list(theta_local_mins[thresholds_satisfied])
 
     return event_inds
 
@@ -26,8 +26,56 @@ def rate_ci(p,n,alpha=0.05):
 
     return ci
 
-def metric_ci(model_substorms,obs_substorms,evaluator,nsamples=4000,ci=97.5,axis=None):
+def sample_contingency_tables(true_positive,false_positive,false_negative,true_negative,nsamples):
+    """
+    Draws bootstrap resamples of contingency tables.
+
+    Resampling n forecast/observation pairs with replacement is equivalent to
+    a multinomial draw of n pairs over the four table entries, with
+    probabilities equal to their observed frequencies. The draw is made as a
+    sequence of conditional binomials, so the counts may be arrays (e.g. one
+    table per model run) and all resamples are drawn at once.
+
+    Returns true_positive,false_positive,false_negative,true_negative arrays,
+    each with a leading axis of length nsamples.
+    """
+
+    counts=[np.asarray(count) for count in (true_positive,false_positive,false_negative,true_negative)]
+    shape=(nsamples,)+np.broadcast(*counts).shape
+
+    remaining=np.broadcast_to(sum(counts),shape).astype(np.int64)
+    remaining_prob=np.ones(shape)
+    n=np.broadcast_to(sum(counts),shape).astype(float)
+
     samples=[]
+    for count in counts[:-1]:
+        prob=np.broadcast_to(count,shape)/np.where(n>0,n,1)
+        conditional_prob=np.clip(prob/np.where(remaining_prob>0,remaining_prob,1),0,1)
+        sample=np.random.binomial(remaining,conditional_prob)
+        samples.append(sample)
+        remaining=remaining-sample
+        remaining_prob=remaining_prob-prob
+    samples.append(remaining)
+
+    return tuple(samples)
+
+def metric_ci(model_substorms,obs_substorms,evaluator,nsamples=4000,ci=97.5,axis=None,method='multinomial',vectorized=True):
+    """
+    Bootstrap confidence interval for a skill metric.
+
+    model_substorms,obs_substorms: Boolean arrays of forecast and observed substorms
+    evaluator: Function of (true_positive,false_positive,false_negative,true_negative)
+    axis: Axis along which the bins are resampled
+    method: 'multinomial' draws all resampled contingency tables at once
+        (see sample_contingency_tables) and calls evaluator on arrays of them;
+        'resample' resamples the bins themselves, one bootstrap sample at a
+        time
+    vectorized: Whether evaluator accepts arrays of counts. If False, the
+        multinomial method calls evaluator once per resampled table, as is
+        needed for evaluators such as peirces_skill that only accept scalars.
+
+    Returns the lower and upper percentiles.
+    """
 
     if axis is None:
         nbins=len(model_substorms)
@@ -38,22 +86,34 @@ def metric_ci(model_substorms,obs_substorms,evaluator,nsamples=4000,ci=97.5,axis
 
     if nbins!=nbins_obs:
         raise ValueError('Model substorms and obs substorms must have same dimensions')
-        
 
-    for i in range(nsamples):
+    if method=='multinomial':
+        tables=sample_contingency_tables(*get_counts(model_substorms,obs_substorms,axis),nsamples=nsamples)
+        if vectorized:
+            samples=np.broadcast_to(evaluator(*tables),tables[0].shape)
+        else:
+            samples=[evaluator(*[count[i] for count in tables]) for i in range(nsamples)]
 
-        inds=np.random.randint(0,nbins,nbins)
+    elif method=='resample':
+        samples=[]
+
+        for i in range(nsamples):
+
+            inds=np.random.randint(0,nbins,nbins)
+
+            model_counts_sample=np.take(model_substorms,inds,axis)
+            obs_counts_sample=np.take(obs_substorms,inds,axis)
+            true_positive,false_positive,false_negative,true_negative=get_counts(model_counts_sample,obs_counts_sample,axis)
+            samples.append(evaluator(true_positive,false_positive,false_negative,true_negative))
+
+    else:
+        raise ValueError('Invalid method passed {} to metric_ci'.format(method))
 
-        model_counts_sample=np.take(model_substorms,inds,axis)
-        obs_counts_sample=np.take(obs_substorms,inds,axis)
-        true_positive,false_positive,false_negative,true_negative=get_counts(model_counts_sample,obs_counts_sample,axis)
-        samples.append(evaluator(true_positive,false_positive,false_negative,true_negative))
-    
     return np.percentile(samples,100-ci,axis=0),np.percentile(samples,ci,axis=0)
 
-def heidke_ci(model_substorms,obs_substorms,nsamples=4000,ci=97.5,axis=None):
+def heidke_ci(model_substorms,obs_substorms,nsamples=4000,ci=97.5,axis=None,method='multinomial'):
 
-    return metric_ci(model_substorms,obs_substorms,heidke_skill,nsamples,ci,axis)
+    return metric_ci(model_substorms,obs_substorms,heidke_skill,nsamples,ci,axis,method)
 
 def heidke_skill(true_positive,false_positive,false_negative,true_negative):
     N=true_positive+false_positive+true_negative+false_negative
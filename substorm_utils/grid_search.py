@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+import numpy as np
+from pytz import UTC
+from substorm_utils.bin_listings import TimeBins, convolve_onsets, sum_signature_scores, sweep_convolution_scores, bin_onsets, bin_maxima
+from substorm_utils.forecast_stats import get_counts, heidke_skill
+
+def convolve_signatures(signatures,keys,bandwidth,resolution=timedelta(0,60),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),epoch=datetime(2005,1,1,tzinfo=UTC),convolution_method='auto'):
+    """
+    Convolves each of the signatures named in keys, as convolved_substorm_scores does.
+
+    Returns dictionaries of score arrays and of their error bounds (see
+    convolve_onsets) keyed by signature type, and the score times in seconds
+    since epoch.
+    """
+
+    bins=TimeBins(tmin,tmax,resolution,epoch)
+
+    signature_scores={}
+    signature_errors={}
+    for key in keys:
+        signature_scores[key],tnums,signature_errors[key]=convolve_onsets(
+            tuple(signatures[key]),bandwidth=bandwidth,method=convolution_method,bins=bins,return_error=True)
+
+    return signature_scores,signature_errors,bins.edges
+
+def combine_scores(signature_scores,signature_errors,keys,signature_weights,nsteps):
+    """
+    Weighted sum of convolved signature scores and its error bound,
+    computed as in convolved_substorm_scores so that the result is identical.
+
+    keys: Signature types in the order convolved_substorm_scores would sum them
+    """
+
+    if not any(signature_weights.get(key,1)>0 for key in keys):
+        return np.zeros(nsteps),np.zeros(nsteps)
+
+    return sum_signature_scores(signature_scores,keys,signature_weights,signature_errors)
+
+def _grid_search_task(args):
+    """
+    Evaluates every combination of signature weights and threshold for one bandwidth.
+    """
+
+    (signatures,obs_substorms,bandwidth,thresholds,signature_weights_list,tstep,tmin,tmax,
+     convolution_resolution,epoch,require_continuous,method,convolution_method)=args
+
+    keys=list(signatures.keys())
+    used_keys=[key for key in keys if max(weights.get(key,1) for weights in signature_weights_list)>0]
+
+    signature_scores,signature_errors,score_tnums=convolve_signatures(signatures,used_keys,bandwidth,convolution_resolution,
+                                                                      tmin,tmax,epoch,convolution_method)
+
+    bin_tnums=TimeBins(tmin,tmax,tstep,epoch).edges
+
+    counts=np.zeros((4,len(signature_weights_list),len(thresholds)),dtype=int)
+
+    for i,signature_weights in enumerate(signature_weights_list):
+        scores,errors=combine_scores(signature_scores,signature_errors,keys,signature_weights,len(score_tnums))
+
+        if method=='convolution_onsets':
+            substorm_bins=np.array([bin_onsets(score_tnums[onset_inds],bin_tnums) for onset_inds in
+                                    sweep_convolution_scores(scores,thresholds,require_continuous,errors)],dtype=bool).reshape(len(thresholds),len(bin_tnums))
+        else:
+            bin_maxes,bin_maxtimes=bin_maxima(scores,score_tnums,bin_tnums)
+            substorm_bins=bin_maxes>=np.asarray(thresholds)[:,np.newaxis]
+
+        counts[:,i,:]=get_counts(substorm_bins,obs_substorms[np.newaxis,:],axis=1)
+
+    return counts
+
+def convolution_grid_search(signatures,obs_substorms,bandwidths,thresholds,signature_weights_list=[{}],tstep=timedelta(0,1800),tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),convolution_resolution=timedelta(0,60),epoch=datetime(2005,1,1,tzinfo=UTC),require_continuous=True,method='convolution_onsets',convolution_method='auto',nprocs=None):
+    """
+    Scores find_substorms_convolution against observed substorms for every
+    combination of bandwidth, signature weights and threshold.
+
+    Each signature is convolved once per bandwidth, the weighted sums are
+    formed from the convolved scores, and all thresholds are evaluated from
+    one peak search (see sweep_convolution_thresholds). The substorm bins for
+    each combination are the same as find_substorms_convolution returns.
+
+    signatures: Dictionary of onset times (datetime, datetime64, or seconds
+        since epoch) keyed by signature type
+    obs_substorms: Boolean array of observed substorm bins, one per tstep from tmin to tmax
+    bandwidths: Sequence of bandwidths
+    thresholds: Sequence of scalar thresholds
+    signature_weights_list: Sequence of signature_weights dictionaries
+    tstep,tmin,tmax,convolution_resolution,epoch,require_continuous,method:
+        As for find_substorms_convolution
+    convolution_method: As for convolve_onsets
+    nprocs: Number of worker processes, each handling one bandwidth at a
+        time (None for one per CPU, 1 to run serially in this process)
+
+    Returns the Heidke skill score and the contingency table
+    (true_positive,false_positive,false_negative,true_negative), as arrays
+    of shape (len(bandwidths),len(signature_weights_list),len(thresholds)).
+    """
+
+    if method not in ('convolution_onsets','bin_maxes'):
+        raise ValueError('Invalid method passed {} to convolution_grid_search'.format(method))
+
+    obs_substorms=np.asarray(obs_substorms,dtype=bool)
+    nbins=len(TimeBins(tmin,tmax,tstep,epoch).edges)
+    if len(obs_substorms)!=nbins:
+        raise ValueError('obs_substorms must have one element per tstep from tmin to tmax ({})'.format(nbins))
+
+    tasks=[(signatures,obs_substorms,bandwidth,list(thresholds),list(signature_weights_list),tstep,tmin,tmax,
+            convolution_resolution,epoch,require_continuous,method,convolution_method)
+           for bandwidth in bandwidths]
+
+    if nprocs==1 or len(tasks)<2:
+        results=[_grid_search_task(task) for task in tasks]
+    else:
+        from multiprocessing import Pool
+        pool=Pool(nprocs)
+        try:
+            results=pool.map(_grid_search_task,tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    counts=np.array(results,dtype=int).reshape(len(tasks),4,len(signature_weights_list),len(thresholds))
+    true_positive,false_positive,false_negative,true_negative=[counts[:,k] for k in range(4)]
+
+    skill=heidke_skill(true_positive,false_positive,false_negative,true_negative)
+
+    return skill,(true_positive,false_positive,false_negative,true_negative)
@@ -2,21 +2,252 @@ from scipy.stats import gaussian_kde
 import numpy as np
 
 class transformed_kde(object):
+    """
+    Gaussian kernel density estimate in transformed coordinates.
 
-    def __init__(self,dataset,bw_method=None,transform=lambda x: x, Dtrans=lambda x: 1):
+    dataset: Data points
+    bw_method: Bandwidth method, as accepted by gaussian_kde
+    transform,Dtrans: Change of variables and its derivative. The density is
+        estimated for transform(dataset) and converted back to the original
+        coordinates by multiplying by abs(Dtrans(x)).
+    binned: If True (1-D data only), the density is computed once on a grid
+        of gridsize points by linear binning and FFT convolution, and
+        interpolated from the grid when evaluated. This avoids the
+        len(dataset)*len(x) cost of gaussian_kde's evaluation.
+    """
+
+    def __init__(self,dataset,bw_method=None,transform=lambda x: x, Dtrans=lambda x: 1,binned=False,gridsize=4096):
     
         self.kde=gaussian_kde(transform(dataset),bw_method)
         self.transform=transform
         self.Dtrans=Dtrans
+        self.binned=binned
+
+        if binned:
+            if self.kde.d!=1:
+                raise ValueError('Binned evaluation only supports 1-D data')
+            sigma=np.sqrt(self.kde.covariance[0,0])
+            self.grid,self.grid_density=_binned_kde(self.kde.dataset,np.array([sigma]),gridsize)
 
     def __call__(self,x):
-        return self.kde(self.transform(x))*np.abs(self.Dtrans(x))
-
-def get_kde_bootstrap(data,evalpoints,nsamples,bw,transform=lambda x: x, Dtrans = lambda x: 1):
-    estimates=np.zeros([len(evalpoints),nsamples])
-    for i in range(nsamples):
-        xstar=np.random.choice(data,len(data))
-        dstar=transformed_kde(xstar,bw_method=bw,transform=transform,Dtrans=Dtrans)
-        estimates[:,i]=dstar(evalpoints)
+        if self.binned:
+            density=_interp_grid(self.grid,self.grid_density,np.asarray(self.transform(x),dtype=float))[0]
+        else:
+            density=self.kde(self.transform(x))
+        return density*np.abs(self.Dtrans(x))
+
+def _binned_kde(datasets,sigma,gridsize,cut=6):
+    """
+    Gaussian KDEs of several equal-sized 1-D datasets on a shared grid.
+
+    datasets: Array of shape (nsets,n)
+    sigma: Kernel standard deviation for each dataset
+    gridsize: Number of grid points
+    cut: Grid extends this many (largest) kernel widths beyond the data
+
+    The data are linearly binned onto the grid and the bin weights of all
+    datasets are convolved with their kernels together, by FFT.
+
+    Returns the grid and an array of shape (nsets,gridsize) of densities.
+    """
+
+    nsets,n=datasets.shape
+    sigma_max=np.max(sigma)
+
+    grid=np.linspace(np.min(datasets)-cut*sigma_max,np.max(datasets)+cut*sigma_max,gridsize)
+    dx=grid[1]-grid[0]
+
+    # Linear binning: split the weight of each point between the two nearest grid points
+    pos=(datasets-grid[0])/dx
+    left=np.clip(np.floor(pos).astype(int),0,gridsize-2)
+    frac=pos-left
+    left+=np.arange(nsets)[:,np.newaxis]*gridsize
+    weights=(np.bincount(left.ravel(),(1-frac).ravel(),nsets*gridsize)
+             +np.bincount(left.ravel()+1,frac.ravel(),nsets*gridsize)).reshape(nsets,gridsize)
+
+    halfwidth=int(np.ceil(cut*sigma_max/dx))
+    x=np.arange(-halfwidth,halfwidth+1)*dx
+    kernels=np.exp(-(x/sigma[:,np.newaxis])**2/2)/(n*sigma[:,np.newaxis]*np.sqrt(2*np.pi))
+
+    nfft=int(2**np.ceil(np.log2(gridsize+2*halfwidth)))
+    density=np.fft.irfft(np.fft.rfft(weights,nfft,axis=1)*np.fft.rfft(kernels,nfft,axis=1),nfft,axis=1)
+    density=np.clip(density[:,halfwidth:halfwidth+gridsize],0,None)
+
+    return grid,density
+
+def _interp_grid(grid,density,x):
+    """
+    Linearly interpolates each row of density from grid to x. Points outside the grid give zero.
+    """
+
+    x=np.atleast_1d(x)
+    dx=grid[1]-grid[0]
+    pos=(x-grid[0])/dx
+    left=np.clip(np.floor(pos).astype(int),0,len(grid)-2)
+    frac=pos-left
+
+    values=density[:,left]*(1-frac)+density[:,left+1]*frac
+    values[:,(x<grid[0])|(x>grid[-1])]=0
+
+    return values
+
+def _kde_factor(bw_method,dataset):
+    """
+    Bandwidth factor that gaussian_kde would use for a 1-D dataset.
+    """
+
+    n=len(dataset)
+
+    if bw_method is None or bw_method=='scott':
+        return n**(-1./5)
+    elif bw_method=='silverman':
+        return (n*3/4.)**(-1./5)
+    elif np.isscalar(bw_method) and not isinstance(bw_method,str):
+        return bw_method
+    else:
+        return gaussian_kde(dataset,bw_method).factor
+
+def _bootstrap_resamples(tdata,nsamples,seed):
+    """
+    Draws the chunk of nsamples bootstrap resamples of tdata for a seed.
+    """
+
+    rng=np.random.RandomState(seed)
+    n=len(tdata)
+
+    return tdata[rng.randint(0,n,(nsamples,n))]
+
+def _resample_factors(bw,tdata,xstar):
+    """
+    Bandwidth factor for each resample. A callable bw is evaluated for each
+    resample, as gaussian_kde would; otherwise the factor depends only on
+    the size of the dataset.
+    """
+
+    if callable(bw):
+        return np.array([_kde_factor(bw,x) for x in xstar])
+    else:
+        return _kde_factor(bw,tdata)
+
+def _kde_bootstrap_task(args):
+    """
+    Evaluates KDEs of nsamples bootstrap resamples of tdata at teval.
+
+    All resamples in a chunk are drawn from one RandomState seeded with seed,
+    and evaluated together, max_elements kernel evaluations at a time, or on
+    a shared grid of gridsize points if gridsize is not None. factors are
+    the bandwidth factors of the resamples, or None to compute them from bw.
+    """
+
+    tdata,teval,nsamples,bw,factors,seed,max_elements,gridsize=args
+
+    n=len(tdata)
+    m=len(teval)
+    estimates=np.zeros([m,nsamples])
+
+    xstar=_bootstrap_resamples(tdata,nsamples,seed)
+
+    if factors is None:
+        factors=_resample_factors(bw,tdata,xstar)
+
+    # Kernel standard deviation of each resample, as computed by gaussian_kde
+    sigma=factors*np.std(xstar,axis=1,ddof=1)
+
+    if gridsize is not None:
+        grid,density=_binned_kde(xstar,sigma,gridsize)
+        return _interp_grid(grid,density,teval).T
+
+    norm=n*sigma*np.sqrt(2*np.pi)
+
+    resample_chunk=max(max_elements//(n*m),1)
+    eval_chunk=max(max_elements//(n*resample_chunk),1)
+
+    for i in range(0,nsamples,resample_chunk):
+        for j in range(0,m,eval_chunk):
+            z=(teval[np.newaxis,j:j+eval_chunk,np.newaxis]
+               -xstar[i:i+resample_chunk,np.newaxis,:])/sigma[i:i+resample_chunk,np.newaxis,np.newaxis]
+            estimates[j:j+eval_chunk,i:i+resample_chunk]=(
+                np.sum(np.exp(-z**2/2),axis=2)/norm[i:i+resample_chunk,np.newaxis]).T
+
     return estimates
 
+def get_kde_bootstrap(data,evalpoints,nsamples,bw,transform=lambda x: x, Dtrans = lambda x: 1,method='batched',nprocs=1,seed=None,chunksize=100,max_elements=10000000,gridsize=4096):
+    """
+    Bootstrap estimates of a (transformed) kernel density.
+
+    data: 1-D dataset
+    evalpoints: Points at which to evaluate the density
+    nsamples: Number of bootstrap resamples
+    bw: Bandwidth method, as accepted by gaussian_kde. With nprocs other
+        than 1, a callable bw is evaluated for each resample in this
+        process, so it need not be picklable.
+    transform,Dtrans: Elementwise change of variables and its derivative, as in transformed_kde
+    method: 'batched' evaluates many resamples together without constructing
+        gaussian_kde objects; 'binned' does the same but bins each chunk
+        of resamples onto a shared grid of gridsize points and evaluates
+        them by FFT convolution (see transformed_kde); 'loop' builds a
+        transformed_kde for each resample using the global numpy random
+        state
+    nprocs: Number of worker processes for the batched and binned methods (None for one per CPU)
+    seed: Seed for the batched and binned methods. Resamples are drawn in chunks of
+        chunksize, each from its own RandomState seeded from this one (or
+        from the global numpy random state if seed is None), so results for
+        a given seed do not depend on nprocs.
+    max_elements: Maximum number of kernel evaluations held in memory at once
+
+    Returns an array of shape (len(evalpoints),nsamples).
+    """
+
+    if method=='loop':
+        if nprocs!=1:
+            raise ValueError('nprocs is only supported by the batched and binned methods')
+
+        estimates=np.zeros([len(evalpoints),nsamples])
+        for i in range(nsamples):
+            xstar=np.random.choice(data,len(data))
+            dstar=transformed_kde(xstar,bw_method=bw,transform=transform,Dtrans=Dtrans)
+            estimates[:,i]=dstar(evalpoints)
+        return estimates
+
+    elif method not in ('batched','binned'):
+        raise ValueError('Invalid method passed {} to get_kde_bootstrap'.format(method))
+
+    if np.ndim(data)!=1:
+        raise ValueError('The {} method only supports 1-D data'.format(method))
+
+    if method=='batched':
+        gridsize=None
+
+    tdata=np.asarray(transform(np.asarray(data)),dtype=float)
+    teval=np.asarray(transform(np.asarray(evalpoints)),dtype=float)
+
+    chunk_sizes=[min(chunksize,nsamples-start) for start in range(0,nsamples,chunksize)]
+    if seed is None:
+        seeds=np.random.randint(0,2**31-1,len(chunk_sizes))
+    else:
+        seeds=np.random.RandomState(seed).randint(0,2**31-1,len(chunk_sizes))
+    tasks=[(tdata,teval,chunk_nsamples,bw,None,chunk_seed,max_elements,gridsize)
+           for chunk_nsamples,chunk_seed in zip(chunk_sizes,seeds)]
+
+    if nprocs==1 or len(tasks)<2:
+        results=[_kde_bootstrap_task(task) for task in tasks]
+    else:
+        if callable(bw):
+            # Functions such as lambdas cannot be sent to the workers, so
+            # compute the bandwidth factors of each chunk's resamples here
+            tasks=[(tdata,teval,chunk_nsamples,None,
+                    _resample_factors(bw,tdata,_bootstrap_resamples(tdata,chunk_nsamples,chunk_seed)),
+                    chunk_seed,max_elements,gridsize)
+                   for chunk_nsamples,chunk_seed in zip(chunk_sizes,seeds)]
+
+        from multiprocessing import Pool
+        pool=Pool(nprocs)
+        try:
+            results=pool.map(_kde_bootstrap_task,tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    estimates=np.concatenate(results,axis=1) if results else np.zeros([len(teval),0])
+
+    return estimates*np.abs(np.asarray(Dtrans(np.asarray(evalpoints)),dtype=float)).reshape(-1,1)
@@ -0,0 +1,146 @@
+import os
+import tempfile
+import zipfile
+import numpy as np
+from substorm_utils.parsers.mpb_parsers import decode_digits, digit_field
+from substorm_utils.timeseries import to_seconds
+
+_unix_epoch=np.datetime64('1970-01-01T00:00:00','s')
+
+image_fuv_columns=['x','y','dist','counts','latgeo','longeo','latmag','lonmag','MLT']
+
+def days_since_unix_epoch(year,month=1,day=1):
+    """
+    Days from 1970-01-01 to the given dates (arrays of year, month and day).
+    """
+
+    months=((np.asarray(year)-1970)*12+np.asarray(month)-1).astype('datetime64[M]')
+
+    return (months.astype('datetime64[D]')-np.datetime64('1970-01-01','D')).astype(np.int64)+np.asarray(day)-1
+
+def _load_sidecar(filename):
+    """
+    Returns the columns stored in the sidecar of filename, or None if there
+    is no sidecar, it is damaged, or it was made from a different version
+    of the file.
+    """
+
+    sidecar=filename+'.npz'
+    stat=os.stat(filename)
+
+    try:
+        with np.load(sidecar) as data:
+            if data['source_size']!=stat.st_size or data['source_mtime']!=stat.st_mtime:
+                return None
+            return dict((name,data[name]) for name in data.files
+                        if name not in ('source_size','source_mtime'))
+    except (IOError,ValueError,KeyError,EOFError,zipfile.BadZipfile):
+        return None
+
+def _save_sidecar(filename,columns):
+    """
+    Saves parsed columns next to filename. Failure to write (e.g. in a
+    read-only directory) is ignored.
+    """
+
+    stat=os.stat(filename)
+
+    # Write to a temporary file and rename it, so that readers never see a partial file
+    try:
+        fd,tmp_path=tempfile.mkstemp(suffix='.tmp',dir=os.path.dirname(os.path.abspath(filename)))
+    except (IOError,OSError):
+        return
+
+    try:
+        with os.fdopen(fd,'wb') as fh:
+            np.savez(fh,source_size=stat.st_size,source_mtime=stat.st_mtime,**columns)
+        os.rename(tmp_path,filename+'.npz')
+    except (IOError,OSError):
+        os.remove(tmp_path)
+
+def _load_catalog(filename,parse,tmin,tmax,sidecar):
+    """
+    Parses a catalog with parse(filename), or reads it from its sidecar, and
+    selects the entries with tmin <= time < tmax.
+    """
+
+    columns=None
+    if sidecar:
+        columns=_load_sidecar(filename)
+
+    if columns is None:
+        columns=parse(filename)
+        if sidecar:
+            _save_sidecar(filename,columns)
+
+    in_window=np.ones(len(columns['time']),dtype=bool)
+    if tmin is not None:
+        in_window&=columns['time']>=to_seconds(tmin,_unix_epoch)
+    if tmax is not None:
+        in_window&=columns['time']<to_seconds(tmax,_unix_epoch)
+
+    return dict((name,values[in_window]) for name,values in columns.items())
+
+def _parse_image_fuv_catalog(filename):
+
+    with open(filename) as fh:
+        lines=fh.read().split('\n')[2:]
+
+    tokens=np.array(' '.join(lines).split()).reshape(-1,len(image_fuv_columns)+1)
+
+    # Dates are of the form XXX_YYYY_MMDD_HH:MM:SS
+    datestr=tokens[:,0]
+    digits=decode_digits(datestr,'????0000_0000_00:00:00')
+    if digits is None:
+        raise ValueError('Unrecognized date format in {}'.format(filename))
+    field=lambda start,stop: digit_field(digits,start,stop)
+
+    days=days_since_unix_epoch(field(4,8),field(9,11),field(11,13))
+    columns={'time':((days*24+field(14,16))*60+field(17,19))*60+field(20,22)}
+
+    values=tokens[:,1:].astype(float)
+    for i,name in enumerate(image_fuv_columns):
+        columns[name]=values[:,i]
+
+    return columns
+
+def load_image_fuv_catalog(filename,tmin=None,tmax=None,sidecar=True):
+    """
+    Reads the IMAGE/FUV substorm onset catalog (substorms_2000_2005.log).
+
+    filename: Path to the catalog
+    tmin,tmax: If given, only onsets with tmin <= time < tmax are returned
+        (datetime or datetime64)
+    sidecar: If True, the parsed catalog is saved as filename+'.npz' and
+        read from there on later calls, until the catalog changes
+
+    Returns a dictionary of arrays: 'time' holds the onset times in int64
+    seconds since 1970-01-01 UTC, and the other columns are named as in
+    image_fuv_columns.
+    """
+
+    return _load_catalog(filename,_parse_image_fuv_catalog,tmin,tmax,sidecar)
+
+def _parse_epdata_catalog(filename):
+
+    values=np.loadtxt(filename,skiprows=1,ndmin=2)
+
+    # Column 2 is the year, and column 3 the (1-based) day of year, truncated to the minute
+    minutes=((values[:,3]-1)*1440).astype(int)
+    days=days_since_unix_epoch(values[:,2].astype(int))
+
+    return {'time':days*86400+minutes.astype(np.int64)*60,'values':values}
+
+def load_epdata_catalog(filename,tmin=None,tmax=None,sidecar=True):
+    """
+    Reads the Borovsky LANL energetic particle substorm catalog
+    (borovsky_epdata_substorms.txt).
+
+    filename,tmin,tmax,sidecar: As for load_image_fuv_catalog
+
+    Returns a dictionary of arrays: 'time' holds the onset times in int64
+    seconds since 1970-01-01 UTC (truncated to the minute), and 'values' the
+    catalog's columns.
+    """
+
+    return _load_catalog(filename,_parse_epdata_catalog,tmin,tmax,sidecar)
@@ -1,3 +1,4 @@
+import numpy as np
 from datetime import datetime
 from pytz import UTC
 
@@ -53,3 +54,169 @@ def parse_index(filename):
             index.append(float(indstr))
 
     return times,index
+
+_mpbdate_regex=r'(\d+)-(\d+)-(\d+)/(\d+):(\d+):(\d+(?:\.\d*)?)'
+_mpbdate_template='0000-00-00/00:00:00.000'
+
+def decode_digits(strings,template):
+    """
+    Decodes the digits of many fixed-width strings at once from their character codes.
+
+    strings: Array of strings
+    template: Layout of the strings: '0' marks a digit, '?' any character,
+        and other characters must appear as given
+
+    Returns an integer array of shape (len(strings),len(template)) holding
+    the value of each digit, or None if any string does not fit the template.
+    """
+
+    strings=np.asarray(strings)
+    width=len(template)
+
+    if strings.dtype.kind=='S':
+        codes=np.ascontiguousarray(strings).view(np.uint8)
+    elif strings.dtype.kind=='U':
+        codes=np.ascontiguousarray(strings).view(np.uint32)
+    else:
+        return None
+
+    if len(strings)==0 or codes.size!=len(strings)*width:
+        return None
+
+    template_codes=np.array([ord(c) for c in template])
+    is_digit=template_codes==ord('0')
+    is_literal=~is_digit & (template_codes!=ord('?'))
+
+    codes=codes.reshape(len(strings),width).astype(int)
+    digits=codes-ord('0')
+
+    if not (np.all((digits[:,is_digit]>=0) & (digits[:,is_digit]<=9))
+            and np.all(codes[:,is_literal]==template_codes[is_literal])):
+        return None
+
+    return digits
+
+def digit_field(digits,start,stop):
+    """
+    Integer value of the digits in columns start:stop of an array returned by decode_digits.
+    """
+
+    return np.dot(digits[:,start:stop],10**np.arange(stop-start-1,-1,-1))
+
+def _mpbdates_to_datetime64(year,month,day,hour,minute,second_f):
+    """
+    Converts arrays of date fields to datetime64.
+
+    Returns a masked array of datetime64 (UTC, microsecond precision), masked
+    where the year is 0, the MPB convention for a missing value.
+    """
+
+    missing=year==0
+
+    year=np.where(missing,1970,year)
+    month=np.where(missing,1,month)
+    day=np.where(missing,1,day)
+
+    # Truncate fractional seconds to microseconds as parse_mpbdate does
+    second=np.trunc(second_f)
+    microsecond=((second_f-second)*1000000).astype(np.int64)
+
+    dates=(((year-1970)*12+month-1).astype('datetime64[M]').astype('datetime64[D]')
+           +(day-1)*np.timedelta64(1,'D'))
+    offsets=((hour*60+minute)*60+second.astype(np.int64))*1000000+microsecond
+
+    return np.ma.array(dates.astype('datetime64[us]')+offsets*np.timedelta64(1,'us'),mask=missing)
+
+def parse_mpbdates(strings):
+    """
+    Vectorized equivalent of parse_mpbdate for a sequence of date strings.
+
+    Strings in the usual fixed-width YYYY-MM-DD/HH:MM:SS.fff format are
+    decoded from their character codes all at once; any others are parsed
+    individually with a regular expression.
+
+    Returns a masked datetime64 array, masked for year-0 entries.
+    """
+    import re
+
+    strings=np.asarray(strings)
+    digits=decode_digits(strings,_mpbdate_template)
+
+    if digits is not None:
+        field=lambda start,stop: digit_field(digits,start,stop)
+
+        # Same value as float() of the seconds string, since both are correctly rounded
+        second_f=(field(17,19)*1000+field(20,23))/1000.
+
+        return _mpbdates_to_datetime64(field(0,4),field(5,7),field(8,10),field(11,13),field(14,16),second_f)
+
+    fields=np.array([re.match(_mpbdate_regex,str(s)).groups() for s in strings],
+                    dtype=[('year',int),('month',int),('day',int),('hour',int),('minute',int),('second',float)]).reshape(-1)
+    return _mpbdates_to_datetime64(*[fields[name] for name in ('year','month','day','hour','minute','second')])
+
+def _read_columns(text,ncols,filename=''):
+    """
+    Splits whitespace-separated text into ncols columns.
+    """
+
+    tokens=text.split()
+    if len(tokens)%ncols!=0:
+        raise ValueError('Expected {} columns in {}'.format(ncols,filename))
+
+    return [np.array(tokens[i::ncols]) for i in range(ncols)]
+
+def load_onsets(filename):
+    """
+    Reads an MPB onset list in one pass.
+
+    Returns a masked datetime64 array, masked for year-0 entries.
+    """
+
+    with open(filename) as fh:
+        onsets,=_read_columns(fh.read(),1,filename)
+
+    return parse_mpbdates(onsets)
+
+def load_onset_tmax(filename):
+    """
+    Reads an MPB onset/tmax list in one pass.
+
+    Returns masked datetime64 arrays of onsets and tmax, masked for year-0 entries.
+    """
+
+    with open(filename) as fh:
+        onsets,tmax=_read_columns(fh.read(),2,filename)
+
+    return parse_mpbdates(onsets),parse_mpbdates(tmax)
+
+def load_index(filename):
+    """
+    Reads an MPB index file in one pass.
+
+    Returns a masked datetime64 array of times (masked for year-0 entries)
+    and a float array of index values.
+    """
+
+    with open(filename) as fh:
+        times,index=_read_columns(fh.read(),2,filename)
+
+    return parse_mpbdates(times),index.astype(float)
+
+def iter_index(filename,chunksize=1000000):
+    """
+    Reads an MPB index file chunksize lines at a time, for files too large
+    to hold in memory.
+
+    Yields (times,index) pairs for each chunk, as returned by load_index.
+    """
+    from itertools import islice
+
+    with open(filename) as fh:
+        while True:
+            lines=list(islice(fh,chunksize))
+            if len(lines)==0:
+                break
+
+            times,index=_read_columns(''.join(lines),2,filename)
+
+            yield parse_mpbdates(times),index.astype(float)
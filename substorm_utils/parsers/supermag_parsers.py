@@ -0,0 +1,191 @@
+import os
+import zlib
+import numpy as np
+from itertools import islice
+from substorm_utils.parsers.catalog_parsers import days_since_unix_epoch
+from substorm_utils.timeseries import to_seconds
+
+_unix_epoch=np.datetime64('1970-01-01T00:00:00','s')
+
+# Number of rows at the start of the sidecar array holding the description of its source (see _source_description)
+_sidecar_header_rows=4
+
+def _row_seconds(values):
+    """
+    Seconds since 1970-01-01 UTC of rows whose first six columns are year, month, day, hour, minute and second.
+    """
+
+    days=days_since_unix_epoch(values[:,0].astype(int),values[:,1].astype(int),values[:,2].astype(int))
+
+    return days*86400.+values[:,3]*3600+values[:,4]*60+values[:,5]
+
+def _to_datetime64(seconds):
+    return _unix_epoch+np.round(seconds).astype(np.int64)*np.timedelta64(1,'s')
+
+def _iter_supermag_chunks(filename,skiprows,chunksize):
+    """
+    Reads the numeric rows of a SuperMAG text file chunksize lines at a time.
+    Blank lines are skipped.
+
+    Yields 2-D float arrays of rows.
+    """
+
+    ncols=None
+    lineno=skiprows
+
+    with open(filename) as fh:
+        for line in islice(fh,skiprows):
+            pass
+
+        while True:
+            lines=list(islice(fh,chunksize))
+            if len(lines)==0:
+                break
+
+            rows=[]
+            for line in lines:
+                lineno+=1
+                row=line.split()
+                if len(row)==0:
+                    continue
+                if ncols is None:
+                    ncols=len(row)
+                if len(row)!=ncols:
+                    raise ValueError('Line {} of {} has {} columns, expected {}'.format(lineno,filename,len(row),ncols))
+                rows.append(row)
+
+            if len(rows)==0:
+                continue
+
+            try:
+                values=np.array(rows,dtype=float)
+            except ValueError:
+                raise ValueError('Non-numeric values in lines {} to {} of {}'.format(lineno-len(lines)+1,lineno,filename))
+
+            yield values
+
+def _source_description(filename,skiprows):
+    """
+    Identifies a text file and how it is parsed: its size, modification
+    time, skiprows, and a checksum of its header lines.
+    """
+
+    stat=os.stat(filename)
+
+    with open(filename,'rb') as fh:
+        header=b''.join(islice(fh,skiprows))
+
+    return np.array([stat.st_size,stat.st_mtime,skiprows,zlib.crc32(header)&0xffffffff],dtype=float)
+
+def supermag_sidecar(filename,skiprows=88,chunksize=100000):
+    """
+    Converts a SuperMAG text file to a memory-mappable binary file,
+    filename+'.npy', unless one made from the same file with the same
+    skiprows already exists.
+
+    The binary file holds a Fortran-ordered float array whose first column is
+    the time in seconds since 1970-01-01 UTC and whose remaining columns are
+    those of the text file, so each column can be read without touching the
+    others. Its first _sidecar_header_rows rows describe the text file
+    (see _source_description) and are not data.
+
+    Returns the path of the binary file.
+    """
+
+    sidecar=filename+'.npy'
+    description=_source_description(filename,skiprows)
+
+    try:
+        existing=np.load(sidecar,mmap_mode='r')
+        if existing.ndim==2 and existing.shape[0]>=_sidecar_header_rows \
+           and np.array_equal(existing[:_sidecar_header_rows,0],description):
+            return sidecar
+    except (IOError,ValueError):
+        pass
+
+    # First pass to find the size of the array
+    nrows=0
+    ncols=0
+    for values in _iter_supermag_chunks(filename,skiprows,chunksize):
+        nrows+=values.shape[0]
+        ncols=values.shape[1]
+
+    # Write to a temporary file and rename it, so that readers never see a partial file
+    tmp_path=sidecar+'.tmp'
+    data=np.lib.format.open_memmap(tmp_path,mode='w+',dtype=float,shape=(nrows+_sidecar_header_rows,ncols+1),fortran_order=True)
+    data[:_sidecar_header_rows,0]=description
+    data[:_sidecar_header_rows,1:]=np.nan
+    start=_sidecar_header_rows
+    for values in _iter_supermag_chunks(filename,skiprows,chunksize):
+        stop=start+values.shape[0]
+        data[start:stop,0]=_row_seconds(values)
+        data[start:stop,1:]=values
+        start=stop
+    data.flush()
+    del data
+
+    os.rename(tmp_path,sidecar)
+
+    return sidecar
+
+def load_supermag(filename,columns=None,tmin=None,tmax=None,skiprows=88,sidecar=True,chunksize=100000):
+    """
+    Reads selected columns of a SuperMAG index file for a time window.
+
+    filename: Path to the SuperMAG text file. Rows must be in time order,
+        starting with year, month, day, hour, minute and second columns.
+    columns: Indices of the text file's columns to return (e.g. [6] for AL
+        in our downloads), or None for all columns
+    tmin,tmax: If given, only rows with tmin <= time < tmax are returned
+        (datetime or datetime64)
+    skiprows: Number of header lines
+    sidecar: If True, the file is converted once to a memory-mapped binary
+        file (see supermag_sidecar), and only the time column and the
+        requested columns are read from it. Otherwise, or if the binary
+        file cannot be written, the text is parsed
+        chunksize lines at a time, keeping only the requested rows and
+        columns, and reading stops once past tmax.
+
+    Returns a datetime64 array of times and a 2-D array with one column per requested column.
+    """
+
+    tmin_s=-np.inf if tmin is None else to_seconds(tmin,_unix_epoch)
+    tmax_s=np.inf if tmax is None else to_seconds(tmax,_unix_epoch)
+
+    if sidecar:
+        try:
+            sidecar_path=supermag_sidecar(filename,skiprows,chunksize)
+        except (IOError,OSError):
+            # Could not write the binary file; parse the text instead
+            sidecar=False
+
+    if sidecar:
+        data=np.load(sidecar_path,mmap_mode='r')[_sidecar_header_rows:]
+        seconds=data[:,0]
+        start=np.searchsorted(seconds,tmin_s,side='left')
+        stop=np.searchsorted(seconds,tmax_s,side='left')
+
+        if columns is None:
+            values=np.array(data[start:stop,1:])
+        else:
+            values=np.array([data[start:stop,column+1] for column in columns]).T.reshape(stop-start,len(columns))
+
+        return _to_datetime64(seconds[start:stop]),values
+
+    selected_seconds=[]
+    selected_values=[]
+    for values in _iter_supermag_chunks(filename,skiprows,chunksize):
+        seconds=_row_seconds(values)
+        in_window=(seconds>=tmin_s) & (seconds<tmax_s)
+        selected_seconds.append(seconds[in_window])
+        if columns is None:
+            selected_values.append(values[in_window])
+        else:
+            selected_values.append(values[in_window][:,columns])
+        if len(seconds)>0 and seconds[-1]>=tmax_s:
+            break
+
+    if len(selected_seconds)==0:
+        return _to_datetime64(np.zeros(0)),np.zeros((0,0 if columns is None else len(columns)))
+
+    return _to_datetime64(np.concatenate(selected_seconds)),np.concatenate(selected_values)
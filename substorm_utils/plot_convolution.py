@@ -1,21 +1,23 @@
 from pytz import UTC
 from datetime import datetime, timedelta
 from substorm_utils.bin_listings import find_convolution_onsets, convolved_substorm_scores
+from substorm_utils.timeseries import to_seconds, tnums_to_datenums
 from matplotlib import pyplot as plt
 import numpy as np
 
 def plot_convolution_score(signatures,ax,tmin,tmax,convolution_resolution=timedelta(0,60),bandwidth=timedelta(minutes=10),epoch=datetime(2005,1,1,tzinfo=UTC),**kwargs):
     scores,tnums=convolved_substorm_scores(signatures,resolution=convolution_resolution,bandwidth=bandwidth,tmin=tmin,tmax=tmax,epoch=epoch)
-    times=np.array([epoch+timedelta(0,s) for s in tnums])
-    in_range=(times>=tmin) & (times<=tmax)
-    times=times[in_range]
+    in_range=(tnums>=to_seconds(tmin,epoch)) & (tnums<=to_seconds(tmax,epoch))
+    times=tnums_to_datenums(tnums[in_range],epoch)
     scores=scores[in_range]
     ax.plot(times,scores)
+    ax.xaxis_date()
     return scores,times
 
 def make_convolution_figure(signatures,threshold,tstart,tend,bandwidth=timedelta(minutes=10),epoch=datetime(2005,1,1,tzinfo=UTC),signature_type_labels={}):
     onsets_all=find_convolution_onsets(signatures,threshold,bandwidth=bandwidth,epoch=epoch,tmin=tstart,tmax=tend)
-    onsets_all=[epoch+timedelta(0,s) for s in onsets_all]
+    onsets_all=tnums_to_datenums(onsets_all,epoch)
+    xlim=tnums_to_datenums(to_seconds([tstart,tend],epoch),epoch)
     fig=plt.figure(figsize=[5.5,5.5])
     from matplotlib.gridspec import GridSpec
 
@@ -31,7 +33,7 @@ def make_convolution_figure(signatures,threshold,tstart,tend,bandwidth=timedelta
         axes.append(ax)
         plot_convolution_score({key:signatures[key]},ax,tstart,tend,bandwidth=bandwidth,epoch=epoch)
         ax.set_ylabel(signature_type_labels.get(key,key))
-        ax.set_xlim(tstart,tend)
+        ax.set_xlim(*xlim)
 
     ax=fig.add_subplot(gs[-1,0],sharex=axes[0])
     axes.append(ax)
@@ -42,12 +44,10 @@ def make_convolution_figure(signatures,threshold,tstart,tend,bandwidth=timedelta
     except:
         ax.axhline(threshold,color='r',alpha=0.5,linewidth=1)
     else:
-        from matplotlib.dates import date2num
-        tstart_num=date2num(tstart)
-        mpl_dates=np.arange(len(threshold))/1440.+tstart_num
+        mpl_dates=tnums_to_datenums(np.arange(len(threshold))*60.,tstart)
         ax.plot(mpl_dates,threshold,color='r',alpha=0.5,linewidth=1)
         
-    ax.set_xlim(tstart,tend)
+    ax.set_xlim(*xlim)
     
     labelpos=(0.98,0.94)
     from string import ascii_lowercase
@@ -0,0 +1,174 @@
+import os
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+
+class SignatureCache(object):
+    """
+    On-disk cache of signature lists (dictionaries of onset time arrays).
+
+    Each entry is stored as an npz file, named by a hash of the input files
+    it was computed from (their paths, sizes and modification times) and the
+    parameters used to compute it. Changing any input file or parameter
+    therefore produces a different key, and stale entries are left to be
+    evicted.
+
+    cachedir: Directory in which to store entries (created if necessary)
+    max_bytes: Total size of entries above which the least recently used
+        entries are removed
+    """
+
+    def __init__(self,cachedir,max_bytes=1000000000):
+        self.cachedir=cachedir
+        self.max_bytes=max_bytes
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def key(self,paths,params={}):
+        """
+        Computes the key for a result.
+
+        paths: Input file paths. Files that do not exist are included in the
+            key as missing, so creating them invalidates the result.
+        params: Dictionary of parameters. Values must have a stable repr.
+        """
+
+        file_stats=[]
+        for path in sorted(os.path.abspath(path) for path in paths):
+            try:
+                stat=os.stat(path)
+            except OSError:
+                file_stats.append((path,None,None))
+            else:
+                file_stats.append((path,stat.st_size,stat.st_mtime))
+
+        description=repr((file_stats,sorted(params.items())))
+
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def _entry_path(self,key):
+        return os.path.join(self.cachedir,key+'.npz')
+
+    def get(self,key):
+        """
+        Returns the signature lists stored under key, or None if there are none.
+        """
+
+        path=self._entry_path(key)
+
+        try:
+            with np.load(path) as entry:
+                onset_lists=dict((name,entry[name]) for name in entry.files)
+        except (IOError,ValueError,zipfile.BadZipfile):
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+
+        return onset_lists
+
+    def put(self,key,onset_lists):
+        """
+        Stores signature lists under key, then evicts entries if the cache is too large.
+        """
+
+        arrays=dict((name,np.asarray(tnums)) for name,tnums in onset_lists.items())
+
+        # Write to a temporary file and rename it, so that readers never see a partial entry
+        fd,tmp_path=tempfile.mkstemp(suffix='.tmp',dir=self.cachedir)
+        try:
+            with os.fdopen(fd,'wb') as fh:
+                np.savez(fh,**arrays)
+            os.rename(tmp_path,self._entry_path(key))
+        except:
+            os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def invalidate(self,key=None):
+        """
+        Removes the entry stored under key, or all entries if key is None.
+        """
+
+        if key is None:
+            paths=[path for path,size,mtime in self._entries()]
+        else:
+            paths=[self._entry_path(key)]
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        """
+        Returns (path,size,mtime) for each entry, least recently used first.
+        """
+
+        entries=[]
+        for filename in os.listdir(self.cachedir):
+            if not filename.endswith('.npz'):
+                continue
+            path=os.path.join(self.cachedir,filename)
+            try:
+                stat=os.stat(path)
+            except OSError:
+                continue
+            entries.append((path,stat.st_size,stat.st_mtime))
+
+        entries.sort(key=lambda entry: entry[2])
+
+        return entries
+
+    def size(self):
+        """
+        Total size in bytes of the cache entries.
+        """
+
+        return sum(size for path,size,mtime in self._entries())
+
+    def evict(self,max_bytes=None):
+        """
+        Removes least recently used entries until the total size is at most max_bytes (default self.max_bytes).
+        """
+
+        if max_bytes is None:
+            max_bytes=self.max_bytes
+
+        entries=self._entries()
+        total=sum(size for path,size,mtime in entries)
+
+        for path,size,mtime in entries:
+            if total<=max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total-=size
+
+def cached_signature_lists(cache,paths,params,function,*args,**kwargs):
+    """
+    Returns function(*args,**kwargs), using cache (a SignatureCache) if it is not None.
+
+    paths,params: Input files and parameters identifying the result, as for SignatureCache.key
+    """
+
+    if cache is None:
+        return function(*args,**kwargs)
+
+    key=cache.key(paths,params)
+    onset_lists=cache.get(key)
+
+    if onset_lists is None:
+        onset_lists=function(*args,**kwargs)
+        cache.put(key,onset_lists)
+
+    return onset_lists
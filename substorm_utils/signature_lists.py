@@ -1,19 +1,22 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy as np
 from substorm_utils.event_id.al_onsets import borovsky_id_algorithm
 import spacepy.datamodel as dm
 from datetime import datetime
-from substorm_utils.event_id.dipolarizations import find_dipolarizations_br_bz_theta
+from substorm_utils.event_id.dipolarizations import find_dipolarization_candidates, merge_dipolarization_candidates
 from cache_decorator import cache_result
 import itertools
 try:
     from functools import lru_cache
 except ImportError:
     from backports.functools_lru_cache import lru_cache
-from substorm_utils.parsers.mpb_parsers import parse_onset_tmax, parse_index, parse_onsets
-from matplotlib.dates import num2date, date2num
+from substorm_utils.parsers.mpb_parsers import load_onset_tmax, load_onsets
+from substorm_utils.parsers.catalog_parsers import load_epdata_catalog, load_image_fuv_catalog
+from substorm_utils.parsers.supermag_parsers import load_supermag
+from substorm_utils.signature_cache import cached_signature_lists
+from matplotlib.dates import date2num
 from pytz import UTC
-from timeseries import interp_timeseries
+from timeseries import interp_channels, to_seconds, tnums_to_times
 import os
 from glob import glob
 
@@ -24,120 +27,369 @@ signature_displaynames={
     'dipolarizations':'Dipolarizations'
 }
 
+def _bisect_dataset(dataset,value,side='left'):
+    """
+    Equivalent to np.searchsorted(dataset[:],value,side) for a sorted 1-D
+    dataset (such as an h5py dataset), reading only O(log n) elements of it.
+    """
+
+    lo=0
+    hi=len(dataset)
+    while lo<hi:
+        mid=(lo+hi)//2
+        if dataset[mid]<value or (side=='right' and dataset[mid]==value):
+            lo=mid+1
+        else:
+            hi=mid
+
+    return lo
+
 @lru_cache(maxsize=10)
 @cache_result()
-def get_dipolarizations(run_name,satname,datadir='.'):
+def get_dipolarizations(run_name,satname,datadir='.',tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC),chunk_length=1440*7):
+    """
+    Finds nightside dipolarizations observed by a virtual or real satellite.
+
+    run_name,satname: Identify the satellite file <run_name>_<satname>.h5 in datadir
+    tmin,tmax: Time range to search. The satellite data are interpolated to a
+        1-minute grid starting at tmin.
+    chunk_length: Number of minutes processed at a time. Only the satellite
+        samples needed for each chunk, plus a margin on either side, are read
+        from the file, so memory use does not grow with the length of the
+        record. The result does not depend on chunk_length.
+
+    Returns an array of dipolarization times.
+    """
+    import h5py
 
     namestr=run_name.replace('/','').replace(' ','_')
-    satdata=dm.fromHDF5(os.path.join(datadir,namestr+'_'+satname+'.h5'))
-    times=np.array(num2date(satdata['numtime']))
-    mlt=(np.arctan2(-satdata['Y'],-satdata['X'])*12/np.pi)%24
-    newtimes=np.array([datetime(2005,1,1,tzinfo=UTC)+timedelta(seconds=s*60) for s in range(1440*31)])
-    bx=interp_timeseries(satdata['bx'],times,newtimes)
-    by=interp_timeseries(satdata['by'],times,newtimes)
-    bz=interp_timeseries(satdata['bz'],times,newtimes)
-    x=interp_timeseries(satdata['X'],times,newtimes)
-    y=interp_timeseries(satdata['Y'],times,newtimes)
-    mlt=interp_timeseries(mlt,times,newtimes)
-    times=newtimes
-
-    br=(bx*x+by*y)/np.sqrt(x**2+y**2)
-    theta=np.arctan2(bz,np.sqrt(bx**2+by**2))*180/np.pi
-
-    dip_inds=find_dipolarizations_br_bz_theta(newtimes,br,bz,theta)
-    night_inds=np.where((mlt<6)|(mlt>18))[0]
-    dip_inds=np.intersect1d(dip_inds,night_inds)
-    dip_times=times[dip_inds]
-
-    satdata['time']=newtimes
-    satdata['bx']=bx
-    satdata['by']=by
-    satdata['bz']=bz
-    satdata['br']=br
-    satdata['theta']=theta
-
-    return dip_times
+    nminutes=int((tmax-tmin).total_seconds()//60)
+    tmin_num=date2num(tmin)
+
+    # Candidates are evaluated using data up to 60 minutes after them, and
+    # duplicates are merged using data up to 60 minutes before and after
+    margin=61
+
+    event_inds=[]
+    nightside=set()
+
+    with h5py.File(os.path.join(datadir,namestr+'_'+satname+'.h5'),'r') as satfile:
+        numtime=satfile['numtime']
+
+        for start in range(0,nminutes,chunk_length):
+            stop=min(start+chunk_length,nminutes)
+            padded_start=max(start-margin,0)
+            padded_stop=min(stop+margin,nminutes)
+
+            # Read the satellite samples bracketing the padded chunk
+            istart=max(_bisect_dataset(numtime,tmin_num+padded_start/1440.)-2,0)
+            istop=_bisect_dataset(numtime,tmin_num+(padded_stop-1)/1440.,side='right')+2
+            satdata=dict((key,satfile[key][istart:istop]) for key in ('numtime','bx','by','bz','X','Y'))
+
+            # Interpolate all channels onto the 1-minute grid at once, working in seconds from tmin
+            sat_tnums=(satdata['numtime']-tmin_num)*86400
+            mlt=(np.arctan2(-satdata['Y'],-satdata['X'])*12/np.pi)%24
+            channels=interp_channels(np.array([satdata['bx'],satdata['by'],satdata['bz'],satdata['X'],satdata['Y'],mlt]),
+                                     sat_tnums,np.arange(padded_start,padded_stop)*60.)
+            bx,by,bz,x,y,mlt=channels
+
+            br=(bx*x+by*y)/np.sqrt(x**2+y**2)
+            theta=np.arctan2(bz,np.sqrt(bx**2+by**2))*180/np.pi
+
+            # Keep candidates in this chunk; those in the margins belong to its neighbors
+            candidates=find_dipolarization_candidates(br,bz,theta)+padded_start
+            candidates=candidates[(candidates>=start)&(candidates<stop)]
+
+            candidate_mlt=mlt[candidates-padded_start]
+            nightside.update(candidates[(candidate_mlt<6)|(candidate_mlt>18)])
+
+            merge_dipolarization_candidates(candidates,bz,theta,event_inds,offset=padded_start)
+
+    dip_inds=[i for i in event_inds if i in nightside]
+
+    return tnums_to_times(np.array(dip_inds,dtype=float)*60,tmin)
+
+def _get_dipolarizations_task(args):
+    run_name,satname,datadir,tmin,tmax=args
+    return get_dipolarizations(run_name,satname,datadir,tmin,tmax)
+
+def get_dipolarizations_batch(run_satellites,datadir='.',nprocs=None,tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC)):
+    """
+    Finds dipolarizations for many virtual or real satellites.
+
+    run_satellites: Sequence of (run_name,satname) pairs, as passed to get_dipolarizations
+    datadir: Directory containing the satellite files
+    nprocs: Number of worker processes (None for one per CPU, 1 to run serially in this process)
+    tmin,tmax: Time range to search
+
+    Returns the dipolarization times for all pairs, merged and sorted.
+    """
+
+    tasks=[(run_name,satname,datadir,tmin,tmax) for run_name,satname in run_satellites]
+
+    if nprocs==1 or len(tasks)<2:
+        results=[_get_dipolarizations_task(task) for task in tasks]
+    else:
+        from multiprocessing import Pool
+        pool=Pool(nprocs)
+        try:
+            results=pool.map(_get_dipolarizations_task,tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    dipolarizations=list(itertools.chain.from_iterable(results))
+    dipolarizations.sort()
+
+    return dipolarizations
 
 def get_tnums(times,epoch=datetime(2005,1,1,tzinfo=UTC)):
-    return np.array([(t-epoch).total_seconds() for t in times])
+    return to_seconds(times,epoch)
 
-def get_model_signature_lists(runprops,epoch=datetime(2005,1,1,tzinfo=UTC),datadir='.'):
+def _minutes_to_tnums(minutes,start=datetime(2005,1,1,tzinfo=UTC),epoch=datetime(2005,1,1,tzinfo=UTC)):
+    """
+    Converts minutes since start to seconds since epoch.
+    """
 
-    onset_lists={}
+    return np.asarray(minutes,dtype=float)*60+to_seconds(start,epoch)
+
+#midn_distances=(3,5,7,10,)#15,20,30,40,50)
+midn_distances=[7]
+model_satellites=['goes10','goes12']+['midn_{0:02d}'.format(distance) for distance in midn_distances]
+obs_satellites=['goes10','goes12']
 
-    auroral_inds=dm.fromHDF5(os.path.join(datadir,runprops['name'].replace('/','').replace(' ','_')+'_auroral_inds.h5'))
+# Included in cache keys; increment when a change to the signature
+# identification procedures invalidates previously cached lists
+signature_lists_version=2
+
+def _model_cache_key(runprops,epoch,datadir):
+    """
+    Input files and parameters identifying the signature lists of a model run in a SignatureCache.
+    """
+
+    namestr=runprops['name'].replace('/','').replace(' ','_')
+    paths=([os.path.join(datadir,namestr+'_auroral_inds.h5'),
+            os.path.join(datadir,'plasmoids_'+namestr+'.h5')]
+           +[os.path.join(datadir,namestr+'_'+satname+'.h5') for satname in model_satellites]
+           +glob(os.path.join(datadir,'John Haiducek - '+namestr+'_mag_grid_lat=4?.matonset_tmax.txt')))
+    params={'function':'get_model_signature_lists','name':runprops['name'],
+            'epoch':epoch,'version':signature_lists_version}
+
+    return paths,params
+
+def get_model_signature_lists(runprops,epoch=datetime(2005,1,1,tzinfo=UTC),datadir='.',nprocs=1,cache=None):
+    """
+    Identifies substorm signatures in the output of a model run.
+
+    runprops: Dictionary of run properties; runprops['name'] identifies the run's files in datadir
+    epoch: Onset times are returned in seconds since epoch
+    nprocs: Number of worker processes for dipolarization identification
+    cache: A SignatureCache in which to look up and store the result, keyed
+        by the input files and the arguments, or None to always compute it
+
+    Returns a dictionary of onset time arrays for each signature type.
+    """
+
+    paths,params=_model_cache_key(runprops,epoch,datadir)
+
+    return cached_signature_lists(cache,paths,params,_get_model_signature_lists,runprops,epoch,datadir,nprocs)
+
+def _model_al_onsets(run_name,epoch,datadir):
+    auroral_inds=dm.fromHDF5(os.path.join(datadir,run_name.replace('/','').replace(' ','_')+'_auroral_inds.h5'))
 
     onsets_borovsky=borovsky_id_algorithm(auroral_inds['AL'])
-    onsets_borovsky=[datetime(2005,1,1,tzinfo=UTC)+timedelta(minutes=m) for m in onsets_borovsky]
 
-    onset_lists['AL']=get_tnums(onsets_borovsky,epoch)
+    return _minutes_to_tnums(onsets_borovsky,epoch=epoch)
 
-    plasmoid_file=os.path.join(datadir,'plasmoids_'+runprops['name'].replace('/','').replace(' ','_')+'.h5')
+def _model_plasmoids(run_name,epoch,datadir):
+    plasmoid_file=os.path.join(datadir,'plasmoids_'+run_name.replace('/','').replace(' ','_')+'.h5')
     if os.path.isfile(plasmoid_file):
         plasmoid_data=dm.fromHDF5(plasmoid_file)
-        plasmoid_times=np.array([datetime.strptime(s,'%Y-%m-%dT%H:%M:%S').replace(tzinfo=UTC) for s in plasmoid_data['time']])
+        plasmoid_times=np.asarray(plasmoid_data['time']).astype('datetime64[s]')
         plasmoid_times=plasmoid_times[plasmoid_data['x']>-35]
     else:
         plasmoid_times=[]
-    onset_lists['plasmoids']=get_tnums(plasmoid_times,epoch)
-
-    #midn_distances=(3,5,7,10,)#15,20,30,40,50)
-    midn_distances=[7]
-
-    dipolarizations=list(itertools.chain.from_iterable([
-        get_dipolarizations(runprops['name'],satname,datadir)
-        for satname in ['goes10','goes12']+
-        ['midn_{0:02d}'.format(distance) for distance in midn_distances]]))
-    dipolarizations.sort()
 
-    onset_lists['dipolarizations']=get_tnums(dipolarizations,epoch)
+    return get_tnums(plasmoid_times,epoch)
 
-    namestr=runprops['name'].replace('/','').replace(' ','_')
+def _model_mpb_onsets(run_name,epoch,datadir):
+    namestr=run_name.replace('/','').replace(' ','_')
     mpb_onset_file=glob(os.path.join(datadir,'John Haiducek - '+namestr+'_mag_grid_lat=4?.matonset_tmax.txt'))
     if len(mpb_onset_file)==1:
-        onset,tmax=parse_onset_tmax(mpb_onset_file[0])
+        onset,tmax=load_onset_tmax(mpb_onset_file[0])
+        onset=onset.compressed()
     else:
         onset=[]
-    onset_lists['MPB']=get_tnums(onset,epoch)
+
+    return get_tnums(onset,epoch)
+
+def _get_model_signature_lists(runprops,epoch,datadir,nprocs):
+
+    onset_lists={}
+
+    onset_lists['AL']=_model_al_onsets(runprops['name'],epoch,datadir)
+
+    onset_lists['plasmoids']=_model_plasmoids(runprops['name'],epoch,datadir)
+
+    dipolarizations=get_dipolarizations_batch([
+        (runprops['name'],satname) for satname in model_satellites],datadir,nprocs)
+
+    onset_lists['dipolarizations']=get_tnums(dipolarizations,epoch)
+
+    onset_lists['MPB']=_model_mpb_onsets(runprops['name'],epoch,datadir)
 
     return onset_lists
 
-def get_obs_signature_lists(epoch=datetime(2005,1,1,tzinfo=UTC),datadir='.'):
-    
+def _model_signature_task(args):
+    """
+    Computes one signature list, or the dipolarizations seen by one
+    satellite, for one run.
+
+    Returns (True,onset tnums) on success and (False,traceback) on failure.
+    """
+
+    signature,run_name,satname,epoch,datadir=args
+
+    try:
+        if signature=='AL':
+            tnums=_model_al_onsets(run_name,epoch,datadir)
+        elif signature=='plasmoids':
+            tnums=_model_plasmoids(run_name,epoch,datadir)
+        elif signature=='dipolarizations':
+            tnums=get_tnums(get_dipolarizations(run_name,satname,datadir),epoch)
+        elif signature=='MPB':
+            tnums=_model_mpb_onsets(run_name,epoch,datadir)
+        else:
+            raise ValueError('Invalid signature passed {} to _model_signature_task'.format(signature))
+    except Exception:
+        import traceback
+        return False,traceback.format_exc()
+
+    return True,tnums
+
+def get_model_signature_lists_batch(runprops_list,epoch=datetime(2005,1,1,tzinfo=UTC),datadir='.',nprocs=None,cache=None):
+    """
+    Identifies substorm signatures for many model runs.
+
+    Each signature of each run (and the dipolarizations of each satellite) is
+    scheduled as a separate task on a pool of worker processes. A failing
+    task does not stop the others.
+
+    runprops_list: Sequence of run property dictionaries, as passed to get_model_signature_lists
+    nprocs: Number of worker processes (None for one per CPU, 1 to run serially in this process)
+    cache: Optional SignatureCache, as for get_model_signature_lists. Runs
+        found in the cache are not recomputed, and runs whose tasks all
+        succeed are stored in it.
+
+    Returns a dictionary mapping run names to signature lists (for runs
+    whose tasks all succeeded), and a dictionary mapping the names of the
+    other runs to lists of (signature,satellite,traceback) for their failed
+    tasks. The satellite is None for signatures other than dipolarizations.
+    """
+
+    signature_lists={}
+    keys={}
+    tasks=[]
+
+    for runprops in runprops_list:
+        run_name=runprops['name']
+
+        if cache is not None:
+            paths,params=_model_cache_key(runprops,epoch,datadir)
+            keys[run_name]=cache.key(paths,params)
+            onset_lists=cache.get(keys[run_name])
+            if onset_lists is not None:
+                signature_lists[run_name]=onset_lists
+                continue
+
+        tasks+=[(signature,run_name,None,epoch,datadir) for signature in ('AL','plasmoids','MPB')]
+        tasks+=[('dipolarizations',run_name,satname,epoch,datadir) for satname in model_satellites]
+
+    if nprocs==1 or len(tasks)<2:
+        results=[_model_signature_task(task) for task in tasks]
+    else:
+        from multiprocessing import Pool
+        pool=Pool(nprocs)
+        try:
+            results=pool.map(_model_signature_task,tasks,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    computed={}
+    failures={}
+    for (signature,run_name,satname,epoch,datadir),(success,result) in zip(tasks,results):
+        if success:
+            onset_lists=computed.setdefault(run_name,{})
+            if signature=='dipolarizations':
+                onset_lists.setdefault('dipolarizations',[]).append(result)
+            else:
+                onset_lists[signature]=result
+        else:
+            failures.setdefault(run_name,[]).append((signature,satname,result))
+
+    for run_name,onset_lists in computed.items():
+        if run_name in failures:
+            continue
+
+        # Merge the dipolarizations from all satellites, as get_dipolarizations_batch does
+        onset_lists['dipolarizations']=np.sort(np.concatenate(onset_lists['dipolarizations']))
+
+        signature_lists[run_name]=onset_lists
+        if cache is not None:
+            cache.put(keys[run_name],onset_lists)
+
+    return signature_lists,failures
+
+def get_obs_signature_lists(epoch=datetime(2005,1,1,tzinfo=UTC),datadir='.',nprocs=1,cache=None,tmin=datetime(2005,1,1,tzinfo=UTC),tmax=datetime(2005,2,1,tzinfo=UTC)):
+    """
+    Identifies substorm signatures in observations.
+
+    epoch: Onset times are returned in seconds since epoch
+    tmin,tmax: Time range of the SuperMAG AL data and the dipolarization
+        search, and of the onsets taken from the MPB, EP-data and IMAGE/FUV
+        catalogs
+    nprocs: Number of worker processes for dipolarization identification
+    cache: A SignatureCache in which to look up and store the result, keyed
+        by the input files and the arguments, or None to always compute it
+
+    Returns a dictionary of onset time arrays for each signature type.
+    """
+
+    paths=([os.path.join(datadir,filename) for filename in
+            ['20160728-19-38-supermag.txt','obs_mpb_onsets.txt',
+             'borovsky_epdata_substorms.txt','substorms_2000_2005.log']]
+           +[os.path.join(datadir,'obs_'+satname+'.h5') for satname in obs_satellites])
+    params={'function':'get_obs_signature_lists','epoch':epoch,'tmin':tmin,'tmax':tmax,
+            'version':signature_lists_version}
+
+    return cached_signature_lists(cache,paths,params,_get_obs_signature_lists,epoch,datadir,nprocs,tmin,tmax)
+
+def _get_obs_signature_lists(epoch,datadir,nprocs,tmin,tmax):
+
     onset_lists={}
 
-    supermag_data=np.loadtxt(os.path.join(datadir,'20160728-19-38-supermag.txt'),skiprows=88)
-    obs_al=supermag_data[:,6]
+    al_times,obs_al=load_supermag(os.path.join(datadir,'20160728-19-38-supermag.txt'),[6],tmin,tmax)
 
-    onsets_borovsky=borovsky_id_algorithm(obs_al)
-    onsets_borovsky=[datetime(2005,1,1,tzinfo=UTC)+timedelta(minutes=m) for m in onsets_borovsky]
+    onsets_borovsky=borovsky_id_algorithm(obs_al[:,0])
 
-    onset_lists['AL']=get_tnums(onsets_borovsky,epoch)
+    onset_lists['AL']=get_tnums(al_times[np.asarray(onsets_borovsky,dtype=int)],epoch)
 
-    dipolarizations=list(itertools.chain.from_iterable([
-        get_dipolarizations('obs',satname,datadir)
-        for satname in ['goes10','goes12']]))
-    dipolarizations.sort()
+    dipolarizations=get_dipolarizations_batch([
+        ('obs',satname) for satname in obs_satellites],datadir,nprocs,tmin,tmax)
 
     onset_lists['dipolarizations']=get_tnums(dipolarizations,epoch)
 
-    onsets=parse_onsets(os.path.join(datadir,'obs_mpb_onsets.txt'))
-    onsets=[onset for onset in onsets
-            if onset >= datetime(2005,1,1,tzinfo=UTC)
-            and onset < datetime(2005,2,1,tzinfo=UTC)]
-    onset_lists['MPB']=get_tnums(onsets,epoch)
-
-    borovsky_epdata_substorms=np.loadtxt(os.path.join(datadir,'borovsky_epdata_substorms.txt'),skiprows=1)
-    in_month=(borovsky_epdata_substorms[:,2]==2005) & (borovsky_epdata_substorms[:,3]<32)
-    borovsky_epdata_substorms=borovsky_epdata_substorms[in_month]
-    borovsky_epdata_substorms=((borovsky_epdata_substorms[:,3]-1)*1440).astype(int)
-    borovsky_epdata_substorms=[datetime(2005,1,1,tzinfo=UTC)+timedelta(minutes=m) for m in borovsky_epdata_substorms]
+    onsets=load_onsets(os.path.join(datadir,'obs_mpb_onsets.txt'))
+    onset_tnums=get_tnums(onsets.compressed(),epoch)
+    onset_tnums=onset_tnums[(onset_tnums>=get_tnums(tmin,epoch)) & (onset_tnums<get_tnums(tmax,epoch))]
+    onset_lists['MPB']=onset_tnums
 
-    onset_lists['epdata']=get_tnums(borovsky_epdata_substorms,epoch)
+    epdata_substorms=load_epdata_catalog(os.path.join(datadir,'borovsky_epdata_substorms.txt'),tmin,tmax)
+    onset_lists['epdata']=get_tnums(epdata_substorms['time'].astype('datetime64[s]'),epoch)
 
-    image_fuv_substorms=np.loadtxt(os.path.join(datadir,'substorms_2000_2005.log'),skiprows=2,dtype=[('datestr','|S22'),('x',float),('y',float),('dist',float),('counts',float),('latgeo',float),('longeo',float),('latmag',float),('lonmag',float),('MLT',float)])
-    image_fuv_times=[datetime.strptime(datestr[4:],'%Y_%m%d_%H:%M:%S').replace(tzinfo=UTC) for datestr in image_fuv_substorms['datestr']]
-    onset_lists['image']=get_tnums(image_fuv_times,epoch)
+    image_fuv_substorms=load_image_fuv_catalog(os.path.join(datadir,'substorms_2000_2005.log'),tmin,tmax)
+    onset_lists['image']=get_tnums(image_fuv_substorms['time'].astype('datetime64[s]'),epoch)
 
     return onset_lists
 
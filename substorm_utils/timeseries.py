@@ -1,14 +1,194 @@
 import numpy as np
+from datetime import datetime, timedelta
+from pytz import UTC
 
-def interp_timeseries(data,oldtimes,newtimes):
-    from scipy.interpolate import interp1d
+def to_datetime64(time):
+    """
+    Converts a datetime (naive UTC or timezone-aware) to a numpy datetime64 in UTC.
+    """
+
+    if isinstance(time,np.datetime64):
+        return time
+
+    if time.tzinfo is not None:
+        time=time.replace(tzinfo=None)-time.utcoffset()
+
+    return np.datetime64(time,'us')
+
+def _as_datetime(time,aware):
+    """
+    Converts a datetime or datetime64 to a datetime, timezone-aware (UTC) if
+    aware is True and naive (UTC) otherwise.
+    """
+
+    if isinstance(time,np.datetime64):
+        time=time.astype('datetime64[us]').astype(datetime)
+
+    if aware and time.tzinfo is None:
+        return time.replace(tzinfo=UTC)
+    elif not aware and time.tzinfo is not None:
+        return time.replace(tzinfo=None)-time.utcoffset()
+    else:
+        return time
+
+def timedelta_seconds(delta):
+    """
+    Length in seconds of a timedelta, numpy timedelta64, or number of seconds.
+    """
+
+    if isinstance(delta,timedelta):
+        return delta.total_seconds()
+    elif isinstance(delta,np.timedelta64):
+        return delta/np.timedelta64(1,'s')
+    else:
+        return float(delta)
+
+def to_seconds(times,epoch):
+    """
+    Converts times to seconds since epoch.
+
+    times: A datetime or datetime64, or a sequence of datetime objects, numpy
+        datetime64 array, or numeric times (returned unchanged, as floats).
+        Naive datetimes are taken to be in UTC.
+    epoch: Reference time (datetime or datetime64)
+    """
+
+    times=np.asarray(times)
+
+    if np.issubdtype(times.dtype,np.datetime64):
+        return (times-to_datetime64(epoch))/np.timedelta64(1,'s')
+    elif times.dtype==object:
+        if times.size==0:
+            return np.zeros(times.shape)
+        epoch=_as_datetime(epoch,times.flat[0].tzinfo is not None)
+        return np.array(times-epoch,dtype='timedelta64[us]').astype(np.int64)/1e6
+    else:
+        return times.astype(float)
+
+def tnums_to_datetime64(tnums,epoch):
+    """
+    Converts seconds since epoch to numpy datetime64 (UTC, microsecond precision).
+    """
+
+    microseconds=np.round(np.asarray(tnums,dtype=float)*1e6).astype(np.int64)
+    return to_datetime64(epoch).astype('datetime64[us]')+microseconds*np.timedelta64(1,'us')
+
+def tnums_to_times(tnums,epoch):
+    """
+    Converts seconds since epoch to times of the same kind as epoch: an array
+    of datetime objects (with the time zone of epoch) if epoch is a datetime,
+    and a datetime64 array if epoch is a datetime64.
+    """
+
+    if isinstance(epoch,np.datetime64):
+        return tnums_to_datetime64(tnums,epoch)
+
+    microseconds=np.round(np.asarray(tnums,dtype=float)*1e6).astype(np.int64)
+
+    if microseconds.ndim==0:
+        return epoch+timedelta(microseconds=int(microseconds))
+
+    times=np.empty(microseconds.shape,dtype=object)
+    times[...]=epoch+(microseconds*np.timedelta64(1,'us')).astype(object)
+    return times
+
+def tnums_to_datenums(tnums,epoch):
+    """
+    Converts seconds since epoch to matplotlib date numbers.
+    """
+    from matplotlib.dates import date2num
 
-    epoch=oldtimes[0]
+    return date2num(_as_datetime(epoch,True))+np.asarray(tnums,dtype=float)/86400.
 
-    oldtimes_f=[(t-epoch).total_seconds() for t in oldtimes]
-    newtimes_f=[(t-epoch).total_seconds() for t in newtimes]
+def interp_weights(oldtimes,newtimes):
+    """
+    Computes linear interpolation weights from oldtimes to newtimes.
 
-    interpolator=interp1d(oldtimes_f,data,fill_value=np.nan,bounds_error=False)
+    oldtimes,newtimes: Sequences of datetime objects, datetime64 arrays, or
+        numeric times in a common unit
+
+    Returns a tuple to be passed to apply_interp_weights. The times are
+    converted and searched once, so the weights can be applied to any number
+    of data series sampled at oldtimes.
+    """
+
+    oldtimes=np.asarray(oldtimes)
+    if oldtimes.dtype==object or np.issubdtype(oldtimes.dtype,np.datetime64):
+        epoch=oldtimes[0]
+    else:
+        epoch=None
+    oldtimes_f=to_seconds(oldtimes,epoch)
+    newtimes_f=to_seconds(newtimes,epoch)
+
+    # interp1d sorts the old times, so do the same
+    if np.any(np.diff(oldtimes_f)<0):
+        order=np.argsort(oldtimes_f,kind='mergesort')
+        oldtimes_f=oldtimes_f[order]
+    else:
+        order=np.arange(len(oldtimes_f))
+
+    # Last old time at or before each new time, as in np.interp (which
+    # interp1d uses for 1-D data), so that among repeated old times the last
+    # one is used
+    n=len(oldtimes_f)
+    last=np.searchsorted(oldtimes_f,newtimes_f,side='right')-1
+    lo=np.clip(last,0,max(n-2,0))
+    hi=np.minimum(lo+1,n-1)
+
+    # Same arithmetic as np.interp: slope*(x_new-x_lo)+y_lo, or the old value where the times coincide
+    offset=newtimes_f-oldtimes_f[lo]
+    spacing=oldtimes_f[hi]-oldtimes_f[lo]
+    exact=np.where(oldtimes_f[np.maximum(last,0)]==newtimes_f)[0]
+    out_of_bounds=(newtimes_f<oldtimes_f[0])|(newtimes_f>oldtimes_f[-1])
+
+    return order[lo],order[hi],offset,spacing,out_of_bounds,exact,order[last[exact]]
+
+def apply_interp_weights(data,weights):
+    """
+    Interpolates data using weights computed by interp_weights.
+
+    data: Array with time along the last axis
+    weights: Output of interp_weights
+
+    Times outside the range of the original times give NaN.
+    """
+
+    lo,hi,offset,spacing,out_of_bounds,exact,exact_inds=weights
+
+    data=np.asarray(data,dtype=float)
+    y_lo=data[...,lo]
+    y_hi=data[...,hi]
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        result=(y_hi-y_lo)/spacing*offset+y_lo
+    result[...,exact]=data[...,exact_inds]
+    result[...,out_of_bounds]=np.nan
+
+    return result
+
+def interp_channels(channels,oldtimes,newtimes):
+    """
+    Interpolates several data series sampled at the same times.
+
+    channels: Dictionary of 1-D arrays, or an array with time along the last axis
+    oldtimes,newtimes: As for interp_weights
+
+    Returns the interpolated channels in the same form as channels.
+    """
+
+    weights=interp_weights(oldtimes,newtimes)
+
+    if isinstance(channels,dict):
+        return dict((key,apply_interp_weights(value,weights)) for key,value in channels.items())
+    else:
+        return apply_interp_weights(channels,weights)
+
+def interp_timeseries(data,oldtimes,newtimes):
+    """
+    Linearly interpolates data from oldtimes to newtimes, returning NaN outside the range of oldtimes.
 
-    return interpolator(newtimes_f)
+    data: Array with time along the last axis (several channels may be passed as a 2-D array)
+    oldtimes,newtimes: Sequences of datetime objects, datetime64 arrays, or numeric times
+    """
 
+    return interp_channels(data,oldtimes,newtimes)
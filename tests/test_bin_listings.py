@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+import numpy as np
+from pytz import UTC
+from substorm_utils.bin_listings import find_substorms, find_substorms_convolution
+
+epoch=datetime(2005,1,1,tzinfo=UTC)
+
+def _signatures():
+    rng=np.random.RandomState(0)
+    seconds={key:np.sort(np.round(rng.uniform(0,86400,50))) for key in ['a','b','c']}
+    datetime64s={key:np.datetime64('2005-01-01T00:00:00')+values.astype('timedelta64[s]')
+                 for key,values in seconds.items()}
+    return seconds,datetime64s
+
+def test_find_substorms_datetime64_signatures():
+    seconds,datetime64s=_signatures()
+    kwargs=dict(tstep=timedelta(0,1800),epoch=epoch,return_times=True)
+
+    for sparse in [False,True]:
+        expected_bins,expected_times=find_substorms(seconds,2,sparse=sparse,**kwargs)
+        bins,times=find_substorms(datetime64s,2,sparse=sparse,**kwargs)
+
+        assert np.all(bins==expected_bins)
+        assert np.all(times==expected_times)
+
+def test_find_substorms_convolution_datetime64_signatures():
+    seconds,datetime64s=_signatures()
+    kwargs=dict(tmin=epoch,tmax=epoch+timedelta(days=1),epoch=epoch,return_times=True)
+
+    for method in ['convolution_onsets','bin_maxes']:
+        expected_bins,expected_times=find_substorms_convolution(seconds,1.5,method=method,**kwargs)
+        bins,times=find_substorms_convolution(datetime64s,1.5,method=method,**kwargs)
+
+        assert np.any(expected_bins)
+        assert np.all(bins==expected_bins)
+        assert list(times)==list(expected_times)
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+from substorm_utils.parsers.catalog_parsers import load_epdata_catalog
+
+def _write_catalog(dirname):
+    filename=os.path.join(dirname,'borovsky_epdata_substorms.txt')
+    with open(filename,'w') as fh:
+        fh.write('num a year day\n')
+        for i,(year,day) in enumerate([(2005,24.776899),(2006,3.642748),(2004,24.195605)]):
+            fh.write('{} 0.1 {} {}\n'.format(i,year,day))
+    return filename
+
+def test_damaged_sidecar_is_rebuilt():
+    dirname=tempfile.mkdtemp()
+    try:
+        filename=_write_catalog(dirname)
+        expected=load_epdata_catalog(filename,sidecar=False)
+
+        load_epdata_catalog(filename)
+        with open(filename+'.npz','rb') as fh:
+            contents=fh.read()
+
+        for damaged in [contents[:len(contents)//2],b'']:
+            with open(filename+'.npz','wb') as fh:
+                fh.write(damaged)
+
+            catalog=load_epdata_catalog(filename)
+            assert np.all(catalog['time']==expected['time'])
+            assert np.all(catalog['values']==expected['values'])
+
+            # The sidecar was rewritten, without leaving temporary files behind
+            assert zipfile.is_zipfile(filename+'.npz')
+            assert sorted(os.listdir(dirname))==['borovsky_epdata_substorms.txt','borovsky_epdata_substorms.txt.npz']
+    finally:
+        shutil.rmtree(dirname)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+import numpy as np
+from pytz import UTC
+import pytest
+from scipy.signal import find_peaks
+from substorm_utils.bin_listings import convolve_onsets, convolved_substorm_scores, search_convolution_scores, sweep_convolution_scores
+
+epoch=datetime(2005,1,1,tzinfo=UTC)
+
+def _random_signatures(rng,duration):
+    signatures={}
+    for key in ['a','b','c']:
+        onsets=rng.uniform(0,duration,rng.randint(0,200))
+
+        # Whole-minute onsets produce scores that are exactly tied between
+        # neighbouring samples, which the peak search must treat alike for all methods
+        if rng.rand()<0.5:
+            onsets=np.round(onsets/60)*60
+
+        signatures[key]=np.sort(onsets)
+
+    return signatures
+
+def test_onsets_match_across_convolution_methods():
+    rng=np.random.RandomState(0)
+    duration=2*86400
+
+    for trial in range(120):
+        signatures=_random_signatures(rng,duration)
+        bandwidth=timedelta(minutes=int(rng.choice([1,5,10,30])))
+        threshold=rng.uniform(0.2,2)
+
+        onsets={}
+        errors={}
+        for method in ['direct','fft','sparse','auto']:
+            scores,tnums,error=convolved_substorm_scores(signatures,bandwidth=bandwidth,tmin=epoch,
+                                                         tmax=epoch+timedelta(seconds=duration),
+                                                         epoch=epoch,convolution_method=method,
+                                                         return_error=True)
+            onsets[method]=search_convolution_scores(scores,threshold,tolerance=error)
+
+            swept=sweep_convolution_scores(scores,[threshold],tolerance=error)[0]
+            assert list(swept)==onsets[method],(trial,method)
+
+            errors[method]=error
+
+        for method in ['fft','sparse','auto']:
+            assert onsets[method]==onsets['direct'],(trial,method)
+            assert np.all(errors[method]==errors['direct']),(trial,method)
+
+def test_direct_peaks_match_find_peaks():
+    rng=np.random.RandomState(1)
+
+    for trial in range(200):
+        # Few distinct values, so that there are plateaus of every length
+        scores=rng.randint(0,4,rng.randint(0,50)).astype(float)
+        expected=list(find_peaks(scores)[0]+1)
+        threshold=0.5
+
+        above=scores>threshold
+        if len(expected)==0 or not np.any(above[expected]):
+            continue
+
+        assert search_convolution_scores(scores,threshold,require_continuous=False)==[i for i in expected if above[i]]
+
+def test_explicit_method_with_long_kernel():
+    tmax=epoch+timedelta(hours=1)
+
+    scores,tnums=convolve_onsets([600.],tmin=epoch,tmax=tmax,bandwidth=timedelta(minutes=15),epoch=epoch,method='auto')
+    direct,tnums=convolve_onsets([600.],tmin=epoch,tmax=tmax,bandwidth=timedelta(minutes=15),epoch=epoch,method='direct')
+    assert np.all(scores==direct)
+
+    for method in ['fft','sparse']:
+        with pytest.raises(ValueError):
+            convolve_onsets([600.],tmin=epoch,tmax=tmax,bandwidth=timedelta(minutes=15),epoch=epoch,method=method)
@@ -0,0 +1,16 @@
+import numpy as np
+from substorm_utils.kde import get_kde_bootstrap
+
+def test_bootstrap_follows_global_seed():
+    data=np.random.RandomState(0).lognormal(size=200)
+    evalpoints=np.linspace(0.1,5,20)
+
+    for method in ['batched','binned']:
+        np.random.seed(3)
+        first=get_kde_bootstrap(data,evalpoints,50,None,method=method,chunksize=20)
+        np.random.seed(3)
+        second=get_kde_bootstrap(data,evalpoints,50,None,method=method,chunksize=20)
+        third=get_kde_bootstrap(data,evalpoints,50,None,method=method,chunksize=20)
+
+        assert np.all(first==second)
+        assert not np.all(first==third)